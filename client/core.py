@@ -10,14 +10,22 @@ class ClientAppCore:
     def __init__(self):
         self.config = AppConfig()
         self.session = requests.Session()
+        self.my_items = None
 
-    def request_with_token(self, name, data = {}):
+    def request(self, name, data = None):
+        ''' Returns the whole json response '''
         url = f'http://{self.config.host}:{self.config.port}/{name}'
-        try:
-            # extend data with token
-            data['token'] = self.token
+        # the token is sent in the authorization header,
+        # requests without data are plain GETs
+        if data is None:
+            resp = self.session.get(url, timeout=3)
+        else:
             resp = self.session.post(url, json=data, timeout=3)
-            data = resp.json()
+        return resp.json()
+
+    def request_with_token(self, name, data = None):
+        try:
+            data = self.request(name, data)
             if data['status'] == 'ok':
                 return True, data['data']
             else:
@@ -39,33 +47,70 @@ class ClientAppCore:
 
         return ok, result
 
+    def get_items(self):
+        ''' All items and my items, those which aren't cached come in one request '''
+        ops = []
+        if not hasattr(self, 'all_items'):
+            ops.append(('get_all_items', {}))
+        if self.my_items is None:
+            ops.append(('get_my_items', {}))
+
+        if ops:
+            results = self.batch(ops, stop_on_error=True)
+            for (name, _), (ok, result) in zip(ops, results):
+                if not ok:
+                    return False, result
+                if name == 'get_all_items':
+                    self.all_items = result
+                else:
+                    self.my_items = result
+
+        return True, (self.all_items, self.my_items)
+
     def get_my_items(self):
-        return self.request_with_token('get_my_items')
+        # return cached items, if present, they are updated by every trade
+        if self.my_items is not None:
+            return True, self.my_items
 
-    def buy_item(self, item_id):
-        ok, result = self.request_with_token('buy_item', {'id': item_id})
+        ok, result = self.request_with_token('get_my_items')
 
         if ok:
-            self.invalidate_account_info()
+            self.my_items = result
 
         return ok, result
 
-    def sell_item(self, item_id):
-        ok, result = self.request_with_token('sell_item', {'id': item_id})
+    def batch(self, ops, stop_on_error = False):
+        ''' Run several operations in one request, ops is a list of
+        (name, args) pairs, returns an (ok, result) pair per operation '''
+        data = {
+            'ops': [{'op': name, 'args': args} for name, args in ops],
+            'stop_on_error': stop_on_error
+        }
+        ok, results = self.request_with_token('batch', data)
+        if not ok:
+            return [(False, results)]
+        return [(res['status'] == 'ok', res['data']) for res in results]
 
-        if ok:
-            self.invalidate_account_info()
+    def buy_item(self, item_id):
+        return self.trade('buy_item', item_id)
 
-        return ok, result
+    def sell_item(self, item_id):
+        return self.trade('sell_item', item_id)
 
-    def invalidate_account_info(self):
-        ok, result = self.request_with_token('get_account_info')
+    def trade(self, name, item_id):
+        try:
+            data = self.request(name, {'id': item_id, 'items': True})
+        except Exception as e:
+            logging.info(e)
+            return False, 'Error during getting data!'
 
-        if not ok:
-            return
+        if data['status'] != 'ok':
+            return False, data['data']
 
-        # update data
-        self.account_info = result
+        # the new credits and items come with the result
+        self.account_info = data['account']
+        self.my_items = data['items']
+        return True, data['data']
 
     def login(self, nickname):
         login_url = f'http://{self.config.host}:{self.config.port}/login'
@@ -76,9 +121,11 @@ class ClientAppCore:
             if data['status'] == 'ok':
                 # store token
                 self.token = data['token']
+                self.session.headers['Authorization'] = f'Bearer {self.token}'
 
                 # store account data
                 self.account_info = data['data']
+                self.my_items = None
                 return True, self.account_info
             else:
                 return False, data['data']
@@ -89,11 +136,12 @@ class ClientAppCore:
     def logout(self):
         logout_url = f'http://{self.config.host}:{self.config.port}/logout'
         try:
-            data = {'token': self.token}
-            resp = self.session.post(logout_url, json=data, timeout=3)
+            self.session.post(logout_url, timeout=3)
         except Exception as e:
             logging.info(e)
         self.token = None
+        self.my_items = None
+        self.session.headers.pop('Authorization', None)
 
     @staticmethod
     def check_nickname(nickname):
@@ -131,15 +131,11 @@ class ClientAppUi:
             ))
 
     def show_my_items(self):
-        ok, result_all_items = self.core_app.get_all_items()
+        ok, result = self.core_app.get_items()
         if not ok:
             print_formatted_text(f'Ошибка получения данных.\n{result}\n')
             return
-
-        ok, result_my_items = self.core_app.get_my_items()
-        if not ok:
-            print_formatted_text(f'Ошибка получения данных.\n{result_my_items}\n')
-            return
+        result_all_items, result_my_items = result
 
         print_formatted_text('Моё имущество\n')
 
@@ -160,15 +156,11 @@ class ClientAppUi:
             ))
 
     def buy_item(self):
-        ok, result_all_items = self.core_app.get_all_items()
-        if not ok:
-            print_formatted_text(f'Ошибка получения данных.\n{result_all_items}\n')
-            return
-
-        ok, result_my_items = self.core_app.get_my_items()
+        ok, result = self.core_app.get_items()
         if not ok:
-            print_formatted_text(f'Ошибка получения данных.\n{result_my_items}\n')
+            print_formatted_text(f'Ошибка получения данных.\n{result}\n')
             return
+        result_all_items, result_my_items = result
 
         my_credits = self.core_app.account_info['credits']
         print_formatted_text('Покупка имущества (отображено имущество доступное к покупке)')
@@ -233,15 +225,11 @@ class ClientAppUi:
                 return
 
     def sell_item(self):
-        ok, result_all_items = self.core_app.get_all_items()
+        ok, result = self.core_app.get_items()
         if not ok:
-            print_formatted_text(f'Ошибка получения данных.\n{result_all_items}\n')
-            return
-
-        ok, result_my_items = self.core_app.get_my_items()
-        if not ok:
-            print_formatted_text(f'Ошибка получения данных.\n{result_my_items}\n')
+            print_formatted_text(f'Ошибка получения данных.\n{result}\n')
             return
+        result_all_items, result_my_items = result
 
         print_formatted_text('Продажа имущества (отображено имущество доступное для продажи)\n')
 
@@ -0,0 +1,141 @@
+import collections
+import logging
+import random
+import threading
+import time
+from aiohttp.abc import AbstractAccessLogger
+from aiohttp.web_log import AccessLogger
+
+
+class BatchedAccessLogger(AbstractAccessLogger):
+    ''' aiohttp creates one access logger per connection, all of them
+    hand the requests over to the same writer '''
+
+    writer = None
+
+    def log(self, request, response, time):
+        self.writer.append(request, response, time)
+
+
+class RequestView:
+    ''' The parts of a request the access log format reads, copied on the loop '''
+    __slots__ = ('remote', 'method', 'path_qs', 'version', 'headers')
+
+    def __init__(self, request):
+        self.remote = request.remote
+        self.method = request.method
+        self.path_qs = request.path_qs
+        self.version = request.version
+        self.headers = request.headers
+
+
+class ResponseView:
+    __slots__ = ('status', 'body_length', 'headers')
+
+    def __init__(self, response):
+        self.status = response.status
+        self.body_length = response.body_length
+        self.headers = response.headers
+
+
+class AccessLogWriter:
+    ''' Access log which costs the event loop a small copy of each request:
+    the copies go to a bounded buffer, a background thread formats them
+    with aiohttp's access log format and logs them in batches, one record
+    per request. A full buffer drops lines instead of blocking, and
+    requests may be sampled, though server errors are always kept '''
+
+    def __init__(self, logger, sample_rate=1.0, capacity=10_000, flush_interval=0.2,
+                 log_format=AccessLogger.LOG_FORMAT):
+        self.logger = logger
+        self.sample_rate = sample_rate
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.log_format = log_format
+        # the format with %s in place of its atoms, and a method per atom
+        self._format, self._methods = AccessLogger(logger, log_format).compile_format(log_format)
+        self.written = 0
+        self.failed = 0
+        self.sampled_out = 0
+        self.dropped = 0
+        self._buffer = collections.deque()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = threading.Thread(target=self.run, name='access-log', daemon=True)
+        self._dropped_reported = 0
+        self._last_second = None
+        self._last_timestamp = ''
+
+    def logger_class(self):
+        return type('BatchedAccessLogger', (BatchedAccessLogger,), {'writer': self})
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join()
+
+    def append(self, request, response, duration):
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        status = response.status
+        if self.sample_rate < 1.0 and status < 500 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return
+        if len(self._buffer) >= self.capacity:
+            self.dropped += 1
+            return
+
+        self._buffer.append((
+            time.time() - duration, RequestView(request), ResponseView(response), duration))
+        if len(self._buffer) >= self.capacity // 2:
+            self._wakeup.set()
+
+    def run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        buffer = self._buffer
+        while buffer:
+            self.write(*buffer.popleft())
+        if self.dropped != self._dropped_reported:
+            self.logger.warning('access log buffer full, %d lines dropped',
+                                self.dropped - self._dropped_reported)
+            self._dropped_reported = self.dropped
+
+    def write(self, started, request, response, duration):
+        # the same values and extra fields as aiohttp's AccessLogger
+        try:
+            values = []
+            extra = {}
+            for key, method in self._methods:
+                if key == 'request_start_time':
+                    # the request's own time, the line is written a bit later
+                    value = self.timestamp(started)
+                else:
+                    value = method(request, response, duration)
+                values.append(value)
+                if key.__class__ is str:
+                    extra[key] = value
+                else:
+                    extra.setdefault(key[0], {})[key[1]] = value
+            self.logger.info(self._format % tuple(values), extra=extra)
+        except Exception:
+            self.failed += 1
+            self.logger.exception('Error in logging')
+        else:
+            self.written += 1
+
+    def timestamp(self, started):
+        # requests of the same second share the formatted time
+        second = int(started)
+        if second != self._last_second:
+            self._last_second = second
+            self._last_timestamp = time.strftime('[%d/%b/%Y:%H:%M:%S +0000]', time.gmtime(second))
+        return self._last_timestamp
@@ -0,0 +1,100 @@
+import math
+import time
+from aiohttp import hdrs, web
+
+from cache import LRUCache
+
+
+class AdmissionControl:
+    ''' Sheds load instead of queueing it: requests over the in-flight
+    limits get 503 right away, and accounts over their request rate get 429;
+    both answers tell the client when to retry '''
+
+    def __init__(self, max_inflight=0, route_limits=None,
+                 rate_per_second=0.0, burst=1, retry_after=1, max_accounts=100_000):
+        self.max_inflight = max_inflight
+        self.route_limits = dict(route_limits or {})
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.retry_after = retry_after
+        self.inflight = 0
+        self.route_inflight = dict.fromkeys(self.route_limits, 0)
+        self.admitted = 0
+        self.shed_inflight = 0
+        self.shed_route = 0
+        self.rate_limited = 0
+        # token bucket of every recently seen account: (tokens, updated)
+        self._buckets = LRUCache(max_accounts)
+
+    def busy_response(self):
+        res = {'status': 'error', 'data': 'Server is busy, try again later!'}
+        return web.json_response(
+            res, status=503, headers={hdrs.RETRY_AFTER: str(self.retry_after)})
+
+    @property
+    def inflight_middleware(self):
+        @web.middleware
+        async def inflight_middleware(request, handler):
+            if self.max_inflight and self.inflight >= self.max_inflight:
+                self.shed_inflight += 1
+                return self.busy_response()
+
+            path = request.path
+            limit = self.route_limits.get(path)
+            if limit is not None and self.route_inflight[path] >= limit:
+                self.shed_route += 1
+                return self.busy_response()
+
+            self.admitted += 1
+            self.inflight += 1
+            if limit is not None:
+                self.route_inflight[path] += 1
+            try:
+                return await handler(request)
+            finally:
+                self.inflight -= 1
+                if limit is not None:
+                    self.route_inflight[path] -= 1
+
+        return inflight_middleware
+
+    def take_token(self, account_id, count=1):
+        ''' Seconds to wait before the account may send count requests, 0 if now '''
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(account_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate_per_second)
+        if tokens < count:
+            self._buckets.put(account_id, (tokens, now))
+            return (count - tokens) / self.rate_per_second
+        self._buckets.put(account_id, (tokens - count, now))
+        return 0
+
+    def rate_limited_response(self, wait):
+        self.rate_limited += 1
+        res = {'status': 'error', 'data': 'Too many requests!'}
+        return web.json_response(
+            res, status=429, headers={hdrs.RETRY_AFTER: str(math.ceil(wait))})
+
+    @property
+    def rate_limit_middleware(self):
+        # runs after authentication, so the account is known
+        @web.middleware
+        async def rate_limit_middleware(request, handler):
+            account_id = request.get('account_id')
+            if self.rate_per_second > 0 and account_id is not None:
+                wait = self.take_token(account_id)
+                if wait:
+                    return self.rate_limited_response(wait)
+            return await handler(request)
+
+        return rate_limit_middleware
+
+    def stats(self):
+        return {
+            'inflight': self.inflight,
+            'route_inflight': dict(self.route_inflight),
+            'admitted': self.admitted,
+            'shed_inflight': self.shed_inflight,
+            'shed_route': self.shed_route,
+            'rate_limited': self.rate_limited
+        }
@@ -19,6 +19,7 @@ from sqlite3 import (  # pylint: disable=redefined-builtin
 )
 
 from .core import Connection, Cursor, connect
+from .stats import QueryStats
 
 __version__ = "0.15.0"
 __all__ = [
@@ -30,6 +31,7 @@ __all__ = [
     "connect",
     "Connection",
     "Cursor",
+    "QueryStats",
     "Row",
     "Warning",
     "Error",
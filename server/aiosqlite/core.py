@@ -9,6 +9,7 @@ import asyncio
 import logging
 import sqlite3
 import sys
+import time
 from functools import partial
 from pathlib import Path
 from queue import Empty, Queue
@@ -17,8 +18,10 @@ from typing import (
     Any,
     AsyncIterator,
     Callable,
+    Dict,
     Generator,
     Iterable,
+    List,
     Optional,
     Type,
     Union,
@@ -27,12 +30,17 @@ from warnings import warn
 
 from .context import contextmanager
 from .cursor import Cursor
+from .stats import QueryStats, TracedConnection
 
 __all__ = ["connect", "Connection", "Cursor"]
 
 LOG = logging.getLogger("aiosqlite")
 
 
+# queued to tell the connection's thread to finish
+_STOP = object()
+
+
 def get_loop(future: asyncio.Future) -> asyncio.AbstractEventLoop:
     if sys.version_info >= (3, 7):
         return future.get_loop()
@@ -40,17 +48,33 @@ def get_loop(future: asyncio.Future) -> asyncio.AbstractEventLoop:
         return future._loop
 
 
+def _set_outcomes(outcomes: List) -> None:
+    """Resolve a batch of futures on their event loop."""
+    for future, exception, result in outcomes:
+        if future.done():
+            # cancelled while the call was queued or executing
+            continue
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+
 class Connection(Thread):
     def __init__(
         self,
         connector: Callable[[], sqlite3.Connection],
         loop: Optional[asyncio.AbstractEventLoop] = None,
     ) -> None:
-        super().__init__()
+        # the thread blocks on the queue until close(), a connection which
+        # is never closed mustn't keep the interpreter alive
+        super().__init__(daemon=True)
         self._running = True
         self._connection: Optional[sqlite3.Connection] = None
         self._connector = connector
         self._tx: Queue = Queue()
+        self._timing_hook: Optional[Callable[[float, float], None]] = None
+        self._traced: Optional[TracedConnection] = None
 
         if loop is not None:
             warn(
@@ -65,48 +89,125 @@ class Connection(Thread):
 
         return self._connection
 
+    @property
+    def _sql_conn(self) -> Union[sqlite3.Connection, TracedConnection]:
+        """The connection to run statements on, traced while stats are enabled."""
+        if self._traced is not None:
+            return self._traced
+        return self._conn
+
     def _execute_insert(
         self, sql: str, parameters: Iterable[Any]
     ) -> Optional[sqlite3.Row]:
-        cursor = self._conn.execute(sql, parameters)
+        cursor = self._sql_conn.execute(sql, parameters)
         cursor.execute("SELECT last_insert_rowid()")
         return cursor.fetchone()
 
     def _execute_fetchall(
         self, sql: str, parameters: Iterable[Any]
     ) -> Iterable[sqlite3.Row]:
-        cursor = self._conn.execute(sql, parameters)
+        cursor = self._sql_conn.execute(sql, parameters)
         return cursor.fetchall()
 
+    def _run_in_transaction(self, fn: Callable, *args, **kwargs) -> Any:
+        conn = self._sql_conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn, *args, **kwargs)
+        except BaseException:
+            conn.rollback()
+            raise
+        if conn.in_transaction:
+            conn.commit()
+        return result
+
     def run(self) -> None:
         """
         Execute function calls on a separate thread.
 
+        Blocks until calls are queued, then executes everything available
+        and hands the results back to each event loop in one batch.
+
         :meta private:
         """
-        while self._running:
-            try:
-                future, function = self._tx.get(timeout=0.1)
-            except Empty:
-                continue
+        while True:
+            batch = [self._tx.get()]
+            while self._tx.qsize():
+                batch.append(self._tx.get_nowait())
+
+            traced = self._traced
+            results: Dict[asyncio.AbstractEventLoop, List] = {}
+            for tx_item in batch:
+                if tx_item is _STOP:
+                    break
 
-            try:
-                LOG.debug("executing %s", function)
-                result = function()
-                LOG.debug("returning %s", result)
-                get_loop(future).call_soon_threadsafe(future.set_result, result)
-            except BaseException as e:
-                LOG.exception("returning exception %s", e)
-                get_loop(future).call_soon_threadsafe(future.set_exception, e)
+                future, function, times = tx_item
+                if times is not None:
+                    times[1] = time.perf_counter()
+                    if traced is not None:
+                        traced.pending_wait = times[1] - times[0]
+                        traced.stats.record_call(traced.pending_wait)
+                try:
+                    LOG.debug("executing %s", function)
+                    result = function()
+                    LOG.debug("returning %s", result)
+                    outcome = (future, None, result)
+                except BaseException as e:
+                    LOG.exception("returning exception %s", e)
+                    outcome = (future, e, None)
+                if times is not None:
+                    times[2] = time.perf_counter()
+                results.setdefault(get_loop(future), []).append(outcome)
+
+            if tx_item is _STOP:
+                # calls queued behind the stop would never run, fail them
+                rest = batch[batch.index(_STOP) + 1 :]
+                while self._tx.qsize():
+                    rest.append(self._tx.get_nowait())
+                for item in rest:
+                    if item is _STOP:
+                        continue
+                    future = item[0]
+                    results.setdefault(get_loop(future), []).append(
+                        (future, ValueError("Connection closed"), None)
+                    )
+
+            for loop, outcomes in results.items():
+                loop.call_soon_threadsafe(_set_outcomes, outcomes)
+
+            if tx_item is _STOP:
+                return
+
+    def _stop(self) -> None:
+        """Let the thread finish once the calls queued so far are executed."""
+        if self._running:
+            self._running = False
+            self._tx.put_nowait(_STOP)
 
     async def _execute(self, fn, *args, **kwargs):
         """Queue a function with the given arguments for execution."""
+        if not self._running:
+            raise ValueError("Connection closed")
+
         function = partial(fn, *args, **kwargs)
         future = asyncio.get_event_loop().create_future()
 
-        self._tx.put_nowait((future, function))
-
-        return await future
+        hook = self._timing_hook
+        if hook is None and self._traced is None:
+            self._tx.put_nowait((future, function, None))
+            return await future
+
+        # queued, started and finished, the thread fills in the last two
+        times = [time.perf_counter(), 0.0, 0.0]
+        self._tx.put_nowait((future, function, times))
+        if self._traced is not None:
+            # the calls waiting for the thread, this one included
+            self._traced.stats.record_queue_length(self._tx.qsize())
+        try:
+            return await future
+        finally:
+            if times[2] and hook is not None:
+                hook(times[1] - times[0], times[2] - times[1])
 
     async def _connect(self) -> "Connection":
         """Connect to the actual sqlite database."""
@@ -114,7 +215,7 @@ class Connection(Thread):
             try:
                 self._connection = await self._execute(self._connector)
             except Exception:
-                self._running = False
+                self._stop()
                 self._connection = None
                 raise
 
@@ -133,7 +234,7 @@ class Connection(Thread):
     @contextmanager
     async def cursor(self) -> Cursor:
         """Create an aiosqlite cursor wrapping a sqlite3 cursor object."""
-        return Cursor(self, await self._execute(self._conn.cursor))
+        return Cursor(self, await self._execute(self._sql_conn.cursor))
 
     async def commit(self) -> None:
         """Commit the current transaction."""
@@ -145,11 +246,14 @@ class Connection(Thread):
 
     async def close(self) -> None:
         """Complete queued queries/cursors and close the connection."""
+        if not self._running:
+            return
+
         try:
             await self._execute(self._conn.close)
         except Exception:
             LOG.exception("exception occurred while closing connection")
-        self._running = False
+        self._stop()
         self._connection = None
 
     @contextmanager
@@ -157,7 +261,7 @@ class Connection(Thread):
         """Helper to create a cursor and execute the given query."""
         if parameters is None:
             parameters = []
-        cursor = await self._execute(self._conn.execute, sql, parameters)
+        cursor = await self._execute(self._sql_conn.execute, sql, parameters)
         return Cursor(self, cursor)
 
     @contextmanager
@@ -183,15 +287,34 @@ class Connection(Thread):
         self, sql: str, parameters: Iterable[Iterable[Any]]
     ) -> Cursor:
         """Helper to create a cursor and execute the given multiquery."""
-        cursor = await self._execute(self._conn.executemany, sql, parameters)
+        cursor = await self._execute(self._sql_conn.executemany, sql, parameters)
         return Cursor(self, cursor)
 
     @contextmanager
     async def executescript(self, sql_script: str) -> Cursor:
         """Helper to create a cursor and execute a user script."""
-        cursor = await self._execute(self._conn.executescript, sql_script)
+        cursor = await self._execute(self._sql_conn.executescript, sql_script)
         return Cursor(self, cursor)
 
+    async def run_in_thread(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Call `fn(conn, *args, **kwargs)` on the connection's thread, where
+        `conn` is the underlying sqlite3 connection, and return its result.
+
+        Everything `fn` does costs a single round trip to the thread.
+        """
+        return await self._execute(fn, self._sql_conn, *args, **kwargs)
+
+    async def run_in_transaction(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Like `run_in_thread`, but wraps the call in BEGIN IMMEDIATE...COMMIT.
+
+        The transaction is rolled back if `fn` raises; `fn` may also roll it
+        back itself and return normally. No other query of this connection
+        can interleave with the transaction.
+        """
+        return await self._execute(self._run_in_transaction, fn, *args, **kwargs)
+
     async def interrupt(self) -> None:
         """Interrupt pending queries."""
         return self._conn.interrupt()
@@ -235,6 +358,42 @@ class Connection(Thread):
     def total_changes(self) -> int:
         return self._conn.total_changes
 
+    def enable_stats(self) -> QueryStats:
+        """
+        Start collecting statistics of the statements this connection runs,
+        see `QueryStats`. Returns the statistics, which are also available
+        as `stats` until `disable_stats` is called.
+        """
+        if self._traced is None:
+            self._traced = TracedConnection(self._conn, QueryStats())
+        return self._traced.stats
+
+    def disable_stats(self) -> None:
+        self._traced = None
+
+    @property
+    def stats(self) -> Optional[QueryStats]:
+        if self._traced is None:
+            return None
+        return self._traced.stats
+
+    @property
+    def timing_hook(self) -> Optional[Callable[[float, float], None]]:
+        """
+        Called with the seconds every call waited in the queue and the
+        seconds it executed, from the task which made the call.
+        """
+        return self._timing_hook
+
+    @timing_hook.setter
+    def timing_hook(self, hook: Optional[Callable[[float, float], None]]) -> None:
+        self._timing_hook = hook
+
+    @property
+    def queue_size(self) -> int:
+        """Number of calls waiting for the connection thread."""
+        return self._tx.qsize()
+
     async def enable_load_extension(self, value: bool) -> None:
         await self._execute(self._conn.enable_load_extension, value)  # type: ignore
 
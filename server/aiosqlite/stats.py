@@ -0,0 +1,236 @@
+# Licensed under the MIT license
+
+"""
+Optional per-statement statistics of a connection
+"""
+
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+__all__ = ["QueryStats", "StatementStats"]
+
+
+class StatementStats:
+    __slots__ = ("calls", "total_time", "max_time", "rows", "queue_wait")
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+        self.queue_wait = 0.0
+
+    def add(self, other: "StatementStats") -> None:
+        self.calls += other.calls
+        self.total_time += other.total_time
+        self.max_time = max(self.max_time, other.max_time)
+        self.rows += other.rows
+        self.queue_wait += other.queue_wait
+
+
+class QueryStats:
+    """
+    Statistics of the statements executed by a connection, by SQL text.
+
+    Execution time includes fetching the rows. Time spent waiting in the
+    connection's queue belongs to calls rather than statements, so it is
+    added to the first statement each call executes. The queue lengths
+    are recorded by the loop which queues the calls, as they are queued;
+    everything else is updated by the connection's thread only.
+    """
+
+    COLUMNS = ("sql", "calls", "total_time", "avg_time", "max_time", "rows", "queue_wait")
+
+    def __init__(self) -> None:
+        self.statements: Dict[str, StatementStats] = {}
+        self.calls = 0
+        self.queue_wait = 0.0
+        self.max_queue_wait = 0.0
+        # calls in the queue when the latest one was queued, and the most
+        self.queue_length = 0
+        self.max_queue_length = 0
+
+    @classmethod
+    def combine(cls, stats: Iterable["QueryStats"]) -> "QueryStats":
+        """Sum up the statistics of several connections."""
+        combined = cls()
+        for item in stats:
+            combined.calls += item.calls
+            combined.queue_wait += item.queue_wait
+            combined.max_queue_wait = max(combined.max_queue_wait, item.max_queue_wait)
+            combined.queue_length += item.queue_length
+            combined.max_queue_length = max(
+                combined.max_queue_length, item.max_queue_length
+            )
+            for sql, statement in list(item.statements.items()):
+                combined.statement(sql).add(statement)
+        return combined
+
+    def statement(self, sql: str) -> StatementStats:
+        statement = self.statements.get(sql)
+        if statement is None:
+            statement = self.statements[sql] = StatementStats()
+        return statement
+
+    def record_call(self, queue_wait: float) -> None:
+        self.calls += 1
+        self.queue_wait += queue_wait
+        self.max_queue_wait = max(self.max_queue_wait, queue_wait)
+
+    def record_queue_length(self, length: int) -> None:
+        self.queue_length = length
+        self.max_queue_length = max(self.max_queue_length, length)
+
+    def rows(self, sort_by: str = "total_time") -> List[Dict[str, Any]]:
+        """One dict per statement, with the keys of `COLUMNS`."""
+        rows = []
+        for sql, statement in list(self.statements.items()):
+            rows.append(
+                {
+                    "sql": sql,
+                    "calls": statement.calls,
+                    "total_time": statement.total_time,
+                    "avg_time": statement.total_time / max(statement.calls, 1),
+                    "max_time": statement.max_time,
+                    "rows": statement.rows,
+                    "queue_wait": statement.queue_wait,
+                }
+            )
+        rows.sort(key=lambda row: row[sort_by], reverse=sort_by != "sql")
+        return rows
+
+    def table(self, sort_by: str = "total_time", limit: Optional[int] = None) -> str:
+        """Format the statistics as a text table, times in milliseconds."""
+        lines = [
+            f"{'calls':>9} {'total ms':>10} {'avg ms':>8} {'max ms':>8} "
+            f"{'rows':>9} {'wait ms':>9}  sql"
+        ]
+        for row in self.rows(sort_by)[:limit]:
+            sql = " ".join(row["sql"].split())
+            lines.append(
+                f"{row['calls']:>9} {row['total_time'] * 1e3:>10.3f} "
+                f"{row['avg_time'] * 1e3:>8.3f} {row['max_time'] * 1e3:>8.3f} "
+                f"{row['rows']:>9} {row['queue_wait'] * 1e3:>9.3f}  {sql}"
+            )
+        lines.append(
+            f"calls: {self.calls}, queue wait: {self.queue_wait * 1e3:.3f} ms "
+            f"(max {self.max_queue_wait * 1e3:.3f} ms), "
+            f"queue length: {self.queue_length} (max {self.max_queue_length})"
+        )
+        return "\n".join(lines)
+
+    def reset(self) -> None:
+        self.__init__()  # type: ignore
+
+
+class TracedCursor:
+    """Proxy of a sqlite3 cursor which times its statements."""
+
+    def __init__(self, cursor: sqlite3.Cursor, traced: "TracedConnection") -> None:
+        self._cursor = cursor
+        self._traced = traced
+        self._statement: Optional[StatementStats] = None
+        self._elapsed = 0.0
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def __iter__(self) -> "TracedCursor":
+        return self
+
+    def __next__(self) -> Any:
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def _timed(self, sql: Optional[str], fn, *args) -> Any:
+        if sql is not None:
+            self._statement = self._traced._start(sql)
+            self._elapsed = 0.0
+        before = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            statement = self._statement
+            if statement is not None:
+                duration = time.perf_counter() - before
+                self._elapsed += duration
+                statement.total_time += duration
+                statement.max_time = max(statement.max_time, self._elapsed)
+
+    def _count(self, rows: int) -> None:
+        if self._statement is not None:
+            self._statement.rows += rows
+
+    def execute(self, sql: str, parameters: Iterable[Any] = ()) -> "TracedCursor":
+        self._timed(sql, self._cursor.execute, sql, parameters)
+        return self
+
+    def executemany(
+        self, sql: str, parameters: Iterable[Iterable[Any]]
+    ) -> "TracedCursor":
+        self._timed(sql, self._cursor.executemany, sql, parameters)
+        return self
+
+    def executescript(self, sql_script: str) -> "TracedCursor":
+        self._timed(sql_script, self._cursor.executescript, sql_script)
+        return self
+
+    def fetchone(self) -> Any:
+        row = self._timed(None, self._cursor.fetchone)
+        if row is not None:
+            self._count(1)
+        return row
+
+    def fetchmany(self, *args: int) -> List[Any]:
+        rows = self._timed(None, self._cursor.fetchmany, *args)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self) -> List[Any]:
+        rows = self._timed(None, self._cursor.fetchall)
+        self._count(len(rows))
+        return rows
+
+
+class TracedConnection:
+    """Proxy of a sqlite3 connection which records statistics of its statements."""
+
+    def __init__(self, connection: sqlite3.Connection, stats: QueryStats) -> None:
+        self._connection = connection
+        self.stats = stats
+        # queue wait of the call being executed, until its first statement
+        self.pending_wait = 0.0
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._connection, name)
+
+    def __enter__(self) -> "TracedConnection":
+        self._connection.__enter__()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> Any:
+        return self._connection.__exit__(*exc_info)
+
+    def _start(self, sql: str) -> StatementStats:
+        statement = self.stats.statement(sql)
+        statement.calls += 1
+        statement.queue_wait += self.pending_wait
+        self.pending_wait = 0.0
+        return statement
+
+    def cursor(self, *args: Any) -> TracedCursor:
+        return TracedCursor(self._connection.cursor(*args), self)
+
+    def execute(self, sql: str, parameters: Iterable[Any] = ()) -> TracedCursor:
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(
+        self, sql: str, parameters: Iterable[Iterable[Any]]
+    ) -> TracedCursor:
+        return self.cursor().executemany(sql, parameters)
+
+    def executescript(self, sql_script: str) -> TracedCursor:
+        return self.cursor().executescript(sql_script)
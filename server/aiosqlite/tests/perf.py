@@ -5,12 +5,16 @@
 Simple perf tests for aiosqlite and the asyncio run loop.
 """
 
+import asyncio
+import sqlite3
 import time
 from pathlib import Path
+from queue import Empty
 
 import aiounittest
 
 import aiosqlite
+from aiosqlite.core import _STOP, get_loop
 
 from .smoke import setup_logger
 
@@ -62,6 +66,30 @@ def timed(fn):
     return wrapper
 
 
+class PollingConnection(aiosqlite.Connection):
+    """
+    The connection thread as it was before results were batched: polls the
+    queue with a timeout and hands every result back to the loop on its own.
+    Kept to compare the queued calls tests with.
+    """
+
+    def run(self) -> None:
+        while self._running:
+            try:
+                tx_item = self._tx.get(timeout=0.1)
+            except Empty:
+                continue
+            if tx_item is _STOP:
+                return
+
+            future, function, _ = tx_item
+            try:
+                result = function()
+                get_loop(future).call_soon_threadsafe(future.set_result, result)
+            except BaseException as e:
+                get_loop(future).call_soon_threadsafe(future.set_exception, e)
+
+
 class PerfTest(aiounittest.AsyncTestCase):
     @classmethod
     def setUpClass(cls):
@@ -152,3 +180,23 @@ class PerfTest(aiounittest.AsyncTestCase):
             while True:
                 yield
                 assert len(await db.execute_fetchall("select i, k from perf")) == 100
+
+    async def queued_calls(self, connection):
+        async with connection as db:
+            await db.execute("create table perf (i integer primary key asc, k integer)")
+            await db.commit()
+
+            def count(conn):
+                return conn.execute("select count(*) from perf").fetchone()
+
+            while True:
+                yield
+                await asyncio.gather(*[db.run_in_thread(count) for _ in range(100)])
+
+    @timed
+    def test_queued_calls(self):
+        return self.queued_calls(aiosqlite.connect(TEST_DB))
+
+    @timed
+    def test_queued_calls_polling(self):
+        return self.queued_calls(PollingConnection(lambda: sqlite3.connect(str(TEST_DB))))
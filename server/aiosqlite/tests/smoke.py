@@ -2,9 +2,12 @@
 # Licensed under the MIT license
 import asyncio
 import sqlite3
+import subprocess
 import sys
+import time
 from pathlib import Path
 from sqlite3 import OperationalError
+import threading
 from threading import Thread
 from unittest import SkipTest, skipIf, skipUnless
 
@@ -269,6 +272,157 @@ class SmokeTest(aiounittest.AsyncTestCase):
             rows = await cursor.fetchall()
             self.assertEqual(rows, [(10,), (24,), (16,)])
 
+    async def test_run_in_thread(self):
+        def insert_and_count(conn, values):
+            conn.executemany("insert into run_in_thread (k) values (?)", values)
+            conn.commit()
+            return conn.execute("select count(*) from run_in_thread").fetchone()[0]
+
+        async with aiosqlite.connect(TEST_DB) as db:
+            await db.execute("create table run_in_thread (k integer)")
+            count = await db.run_in_thread(insert_and_count, [(1,), (2,), (3,)])
+            self.assertEqual(count, 3)
+
+    async def test_run_in_transaction(self):
+        def transfer(conn, amount):
+            conn.execute("update accounts set v = v - ? where i = 1", [amount])
+            (left,) = conn.execute("select v from accounts where i = 1").fetchone()
+            if left < 0:
+                raise ValueError("not enough")
+            conn.execute("update accounts set v = v + ? where i = 2", [amount])
+            return left
+
+        def refuse(conn):
+            conn.execute("update accounts set v = 0")
+            conn.rollback()
+            return False
+
+        async with aiosqlite.connect(TEST_DB) as db:
+            await db.execute("create table accounts (i integer, v integer)")
+            await db.execute("insert into accounts values (1, 10), (2, 0)")
+            await db.commit()
+
+            results = await asyncio.gather(
+                *[db.run_in_transaction(transfer, 3) for _ in range(5)],
+                return_exceptions=True,
+            )
+            self.assertEqual(results[:3], [7, 4, 1])
+            for result in results[3:]:
+                self.assertIsInstance(result, ValueError)
+            self.assertFalse(await db.run_in_transaction(refuse))
+            self.assertFalse(db.in_transaction)
+
+            async with db.execute("select v from accounts order by i") as cursor:
+                self.assertEqual(await cursor.fetchall(), [(1,), (9,)])
+
+    async def test_timing_hook(self):
+        timings = []
+
+        def slow(conn):
+            time.sleep(0.05)
+            return conn.execute("select 1").fetchone()[0]
+
+        async with aiosqlite.connect(TEST_DB) as db:
+            db.timing_hook = lambda wait, duration: timings.append((wait, duration))
+            results = await asyncio.gather(db.run_in_thread(slow), db.run_in_thread(slow))
+            self.assertEqual(results, [1, 1])
+            self.assertEqual(len(timings), 2)
+            (first_wait, first), (second_wait, second) = sorted(timings)
+            self.assertGreaterEqual(first, 0.05)
+            self.assertGreaterEqual(second, 0.05)
+            # the second call waited for the first one to execute
+            self.assertGreaterEqual(second_wait, 0.05)
+
+            db.timing_hook = None
+            await db.run_in_thread(slow)
+            self.assertEqual(len(timings), 2)
+
+    async def test_calls_after_close(self):
+        release = threading.Event()
+        db = await aiosqlite.connect(TEST_DB)
+        blocked = asyncio.ensure_future(db.run_in_thread(lambda conn: release.wait()))
+        await asyncio.sleep(0.05)
+
+        # queued behind the stop while the thread is busy
+        db._stop()
+        late = asyncio.get_event_loop().create_future()
+        db._tx.put_nowait((late, lambda: 1, None))
+        release.set()
+
+        self.assertTrue(await blocked)
+        with self.assertRaisesRegex(ValueError, "Connection closed"):
+            await asyncio.wait_for(late, 5)
+        with self.assertRaisesRegex(ValueError, "Connection closed"):
+            await db.execute("select 1")
+        await db.close()
+
+    def test_unclosed_connection(self):
+        script = (
+            "import asyncio, aiosqlite\n"
+            "async def main():\n"
+            "    db = await aiosqlite.connect(':memory:')\n"
+            "    await db.execute('select 1')\n"
+            "asyncio.get_event_loop().run_until_complete(main())\n"
+        )
+        # the process exits although the connection was never closed
+        root = Path(aiosqlite.__file__).resolve().parent.parent
+        subprocess.run([sys.executable, "-c", script], cwd=root, timeout=30, check=True)
+
+    async def test_stats(self):
+        def count_even(conn):
+            rows = conn.execute("select k from t where k % 2 = 0").fetchall()
+            return len(rows)
+
+        async with aiosqlite.connect(TEST_DB) as db:
+            self.assertIsNone(db.stats)
+            stats = db.enable_stats()
+            self.assertIs(db.stats, stats)
+
+            await db.execute("create table t (k integer)")
+            await db.executemany("insert into t values (?)", [[i] for i in range(10)])
+            for _ in range(3):
+                self.assertEqual(await db.run_in_thread(count_even), 5)
+            async with db.execute("select k from t") as cursor:
+                self.assertEqual(len([row async for row in cursor]), 10)
+
+            rows = {row["sql"]: row for row in stats.rows()}
+            self.assertEqual(rows["select k from t where k % 2 = 0"]["calls"], 3)
+            self.assertEqual(rows["select k from t where k % 2 = 0"]["rows"], 15)
+            self.assertEqual(rows["select k from t"]["calls"], 1)
+            self.assertEqual(rows["select k from t"]["rows"], 10)
+            self.assertEqual(rows["insert into t values (?)"]["rows"], 0)
+            for row in rows.values():
+                self.assertGreater(row["total_time"], 0)
+                self.assertGreaterEqual(row["total_time"], row["max_time"])
+            self.assertGreaterEqual(stats.max_queue_length, 1)
+            self.assertIn("select k from t where k % 2 = 0", stats.table())
+
+            combined = aiosqlite.QueryStats.combine([stats, stats])
+            self.assertEqual(combined.statements["select k from t"].calls, 2)
+
+            db.disable_stats()
+            self.assertIsNone(db.stats)
+            await db.run_in_thread(count_even)
+            self.assertEqual(stats.statements["select k from t where k % 2 = 0"].calls, 3)
+
+    async def test_stats_queue_length(self):
+        release = threading.Event()
+        async with aiosqlite.connect(TEST_DB) as db:
+            stats = db.enable_stats()
+            blocked = asyncio.ensure_future(db.run_in_thread(lambda conn: release.wait()))
+            await asyncio.sleep(0.05)
+
+            # the thread is busy, the calls wait in the queue
+            queued = [asyncio.ensure_future(db.execute_fetchall("select 1")) for _ in range(5)]
+            await asyncio.sleep(0.05)
+            self.assertEqual(stats.queue_length, 5)
+            release.set()
+            await asyncio.gather(blocked, *queued)
+            self.assertEqual(stats.max_queue_length, 5)
+
+        # closing queues the stop, which isn't a call
+        self.assertEqual(stats.max_queue_length, 5)
+
     async def test_enable_load_extension(self):
         """Assert that after enabling extension loading, they can be loaded"""
         async with aiosqlite.connect(TEST_DB) as db:
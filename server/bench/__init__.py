@@ -0,0 +1,8 @@
+import math
+
+
+def percentile(values, p):
+    ''' Nearest-rank percentile of sorted values '''
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
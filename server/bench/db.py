@@ -0,0 +1,181 @@
+''' Microbenchmarks of the db functions.
+
+Every function runs against databases filled with a given number of
+accounts (each owning up to --items items), for every combination of:
+    storage: a file in a temp directory, or :memory:
+    schema:  base (the first migration, no indexes) or indexed (all of them)
+    pool:    readers (writer plus read-only connections), group (the same
+             with group commit) or single (one connection for everything,
+             the only choice for :memory:)
+Caches are off, so every call reaches sqlite.
+
+Run from the server directory:
+    python -m bench.db --sizes 1000,100000 --concurrency 1,16 --out db.json
+'''
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import db
+from bench import percentile
+from migrations import MIGRATIONS, migrate
+
+
+ITEM_IDS = range(1, 101)
+ITEM_PRICE = 100
+START_CREDITS = 1_000_000_000
+SCHEMAS = {'base': 1, 'indexed': len(MIGRATIONS)}
+
+
+def populate(conn, schema_version, accounts, items):
+    migrate(conn, schema_version)
+    conn.execute('BEGIN')
+    conn.executemany(
+        'INSERT INTO Accounts (nickname, credits) VALUES (?, ?)',
+        ((f'player{i}', START_CREDITS) for i in range(1, accounts + 1)))
+    conn.executemany(
+        'INSERT INTO Items (account_id, item_id) VALUES (?, ?)',
+        ((account_id, item_id)
+         for account_id in range(1, accounts + 1)
+         for item_id in random.sample(ITEM_IDS, random.randint(0, items))))
+    conn.commit()
+
+
+def operations(size):
+    ''' name -> fn(pool) doing one call on a random account '''
+    created = iter(range(10**12))
+
+    def account():
+        return random.randint(1, size)
+
+    def find_or_create_account(pool):
+        # one in ten nicknames is new
+        if random.random() < 0.1:
+            return db.find_or_create_account(pool, f'new{next(created)}')
+        return db.find_or_create_account(pool, f'player{account()}')
+
+    return {
+        'find_or_create_account': find_or_create_account,
+        'add_credits_to_account': lambda pool: db.add_credits_to_account(pool, account(), 1),
+        'try_buy_item': lambda pool: db.try_buy_item(
+            pool, account(), random.choice(ITEM_IDS), ITEM_PRICE),
+        'try_sell_item': lambda pool: db.try_sell_item(
+            pool, account(), random.choice(ITEM_IDS), ITEM_PRICE),
+        'get_my_items': lambda pool: db.get_my_items(pool, account()),
+        'get_account_info': lambda pool: db.get_account_info(pool, account()),
+    }
+
+
+async def measure(pool, operation, ops, concurrency, warmup):
+    for _ in range(warmup):
+        await operation(pool)
+
+    latencies = []
+
+    async def worker(count):
+        for _ in range(count):
+            before = time.perf_counter()
+            await operation(pool)
+            latencies.append(time.perf_counter() - before)
+
+    before = time.perf_counter()
+    await asyncio.gather(*[
+        worker(ops // concurrency + (i < ops % concurrency)) for i in range(concurrency)
+    ])
+    duration = time.perf_counter() - before
+    latencies.sort()
+    return {
+        'ops': ops,
+        'ops_per_sec': ops / duration,
+        'p50_ms': percentile(latencies, 50) * 1e3,
+        'p95_ms': percentile(latencies, 95) * 1e3,
+        'p99_ms': percentile(latencies, 99) * 1e3,
+        'max_ms': latencies[-1] * 1e3,
+    }
+
+
+async def open_variant(tmp, storage, schema, pool_kind, size, items):
+    if storage == 'memory':
+        path, readers = ':memory:', 0
+    else:
+        path = Path(tmp) / f'{schema}-{size}.sqlite3'
+        path.unlink(missing_ok=True)
+        readers = 0 if pool_kind == 'single' else 4
+
+    # fill the db before the readers open it
+    writer_only = await db.open_pool(path, 0)
+    await writer_only.writer.run_in_thread(populate, SCHEMAS[schema], size, items)
+    if storage == 'memory':
+        return writer_only
+    await writer_only.close()
+    return await db.open_pool(path, readers, group_commit=pool_kind == 'group')
+
+
+async def run(args):
+    results = []
+    log = print if not args.quiet else lambda *_: None
+    log(f'{"storage":<7} {"schema":<8} {"pool":<8} {"size":>9} {"function":<24} {"conc":>4} '
+        f'{"ops/s":>9} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for storage in args.storage:
+            pools = ['single'] if storage == 'memory' else args.pool
+            for schema in args.schema:
+                for pool_kind in pools:
+                    for size in args.sizes:
+                        pool = await open_variant(tmp, storage, schema, pool_kind, size, args.items)
+                        try:
+                            for name, operation in operations(size).items():
+                                if args.functions and name not in args.functions:
+                                    continue
+                                for concurrency in args.concurrency:
+                                    result = await measure(
+                                        pool, operation, args.ops, concurrency, args.warmup)
+                                    result.update(
+                                        storage=storage, schema=schema, pool=pool_kind,
+                                        size=size, function=name, concurrency=concurrency)
+                                    results.append(result)
+                                    log(f'{storage:<7} {schema:<8} {pool_kind:<8} {size:>9} '
+                                        f'{name:<24} {concurrency:>4} '
+                                        f'{result["ops_per_sec"]:>9.0f} {result["p50_ms"]:>8.3f} '
+                                        f'{result["p95_ms"]:>8.3f} {result["p99_ms"]:>8.3f} '
+                                        f'{result["max_ms"]:>8.3f}')
+                        finally:
+                            await pool.close()
+    return results
+
+
+def csv(convert):
+    return lambda value: [convert(item) for item in value.split(',')]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Microbenchmarks of the db functions')
+    parser.add_argument('--sizes', type=csv(int), default=[1_000, 100_000],
+                        help='accounts in the db, comma separated')
+    parser.add_argument('--items', type=int, default=100, help='max items per account')
+    parser.add_argument('--storage', type=csv(str), default=['file', 'memory'])
+    parser.add_argument('--schema', type=csv(str), default=list(SCHEMAS))
+    parser.add_argument('--pool', type=csv(str), default=['readers', 'group'])
+    parser.add_argument('--functions', type=csv(str), help='only these, comma separated')
+    parser.add_argument('--concurrency', type=csv(int), default=[1, 16])
+    parser.add_argument('--ops', type=int, default=2_000, help='calls per measurement')
+    parser.add_argument('--warmup', type=int, default=100, help='calls before measuring')
+    parser.add_argument('--quiet', action='store_true', help="don't print the results")
+    parser.add_argument('--out', help='save the results to this json file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+    if args.out:
+        Path(args.out).write_text(json.dumps({'config': vars(args), 'results': results}, indent=4))
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+''' Performance regression gate.
+
+Runs the load and db benchmark scenarios, takes the median of every
+metric over several runs (after warmup runs which are thrown away) and
+compares them with the committed baseline. A metric regressed when
+throughput dropped or p99 latency rose by more than the tolerance. A
+metric which moves a lot from run to run gets more room: up to
+--noise-margin times its spread between the baseline's runs, but never
+more than --max-widening times the tolerance. p99 rises below
+--min-latency-change milliseconds are jitter, not regressions. Before
+failing, the scenarios of the regressed metrics are run again and the
+new runs join the median, so that one unlucky run doesn't fail the gate.
+Needs no network besides localhost.
+
+A VM's speed drifts with its neighbours' load, so every run is bracketed
+by a short fixed workload measuring the speed of the machine right then,
+and the run's numbers are scaled to the speed the baseline was recorded
+at before taking the median. The disk's fsync latency drifts even more
+and has nothing to do with the code, so the benchmark databases are
+created in /dev/shm when there is one (see --tmp-dir).
+
+Numbers from another machine say nothing about a regression: when the
+platform, the number of CPUs or the Python version differ from the
+baseline's, the diff is printed and the gate exits with 3 (not gated),
+unless --force is given. Exits with 0 when nothing regressed, and with 1
+when something did.
+
+Run from the server directory, with the python the server runs on:
+    python -m bench.gate                 # compare with bench/baseline.json
+    python -m bench.gate --update        # record a new baseline
+'''
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from bench import db as db_bench
+from bench import load as load_bench
+
+
+BASELINE = Path(__file__).resolve().parent / 'baseline.json'
+RAM_DIR = Path('/dev/shm')
+
+# exit statuses
+PASSED = 0
+REGRESSED = 1
+NOT_GATED = 3
+
+# small and fixed, so that runs stay comparable
+SCENARIOS = {
+    'load': [
+        '--mode', 'inprocess', '--players', '200', '--connections', '50',
+        '--duration', '10', '--trades', '10',
+    ],
+    'db': [
+        '--sizes', '10000', '--items', '20', '--storage', 'file', '--schema', 'indexed',
+        '--pool', 'readers', '--concurrency', '1,16', '--ops', '20000', '--warmup', '1000',
+        '--quiet',
+    ],
+}
+
+
+def run_load(argv):
+    ''' metric name -> value, throughput is higher-is-better, p99 lower '''
+    result = asyncio.run(load_bench.run(load_bench.parse_args(argv)))
+    metrics = {'load.rps': result['rps'], 'load.errors': result['errors']}
+    for endpoint, e in result['endpoints'].items():
+        metrics[f'load.{endpoint}.rps'] = e['rps']
+        metrics[f'load.{endpoint}.p99_ms'] = e['p99_ms']
+    return metrics
+
+
+def run_db(argv):
+    metrics = {}
+    for r in asyncio.run(db_bench.run(db_bench.parse_args(argv))):
+        name = f'db.{r["function"]}.c{r["concurrency"]}'
+        metrics[f'{name}.ops_per_sec'] = r['ops_per_sec']
+        metrics[f'{name}.p99_ms'] = r['p99_ms']
+    return metrics
+
+
+RUNNERS = {'load': run_load, 'db': run_db}
+
+
+def machine():
+    ''' What the numbers depend on besides the code '''
+    return {
+        'platform': f'{platform.system()} {platform.machine()}',
+        'cpus': os.cpu_count(),
+        'python': platform.python_version(),
+        'tmp_dir': tempfile.gettempdir(),
+    }
+
+
+def describe(machine):
+    return (f'{machine["platform"]}, {machine["cpus"]} cpus, python {machine["python"]}, '
+            f'databases in {machine.get("tmp_dir")}')
+
+
+def calibrate(seconds=0.5):
+    ''' Speed of the machine right now: rounds per second of a fixed
+    workload like the server's, json and sqlite calls '''
+    doc = {'status': 'ok', 'data': list(range(50))}
+    with sqlite3.connect(':memory:') as conn:
+        conn.execute('CREATE TABLE t (k INTEGER PRIMARY KEY, v TEXT)')
+        rounds = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            for k in range(100):
+                text = json.dumps(doc)
+                json.loads(text)
+                conn.execute('INSERT OR REPLACE INTO t VALUES (?, ?)', (k, text))
+                conn.execute('SELECT v FROM t WHERE k = ?', (k,)).fetchone()
+            rounds += 1
+        return rounds / (time.perf_counter() - start)
+
+
+def scale(name, value, speed, reference):
+    ''' The value as if measured at the reference speed '''
+    if name.endswith('.errors'):
+        return value
+    if direction(name) < 0:
+        return value * speed / reference
+    return value * reference / speed
+
+
+def summarize(samples, speeds, reference):
+    ''' Median of every metric over the runs scaled to the reference
+    speed, and its spread: the range of the runs relative to the median '''
+    medians, spreads = {}, {}
+    for name, values in samples.items():
+        values = [scale(name, value, speed, reference) for value, speed in zip(values, speeds[name])]
+        medians[name] = statistics.median(values)
+        spreads[name] = (max(values) - min(values)) / medians[name] if medians[name] else 0.0
+    return medians, spreads
+
+
+def measure(scenarios, runs, warmup_runs):
+    ''' Metric name -> values of the runs, and the speed of each run '''
+    samples = {}
+    speeds = {}
+    for scenario in scenarios:
+        for i in range(warmup_runs + runs):
+            kind = 'warmup' if i < warmup_runs else f'run {i - warmup_runs + 1}/{runs}'
+            print(f'{scenario}: {kind}', file=sys.stderr)
+            # garbage of the previous run isn't collected on this run's time
+            gc.collect()
+            before = calibrate()
+            metrics = RUNNERS[scenario](SCENARIOS[scenario])
+            speed = (before + calibrate()) / 2
+            if i < warmup_runs:
+                continue
+            for name, value in metrics.items():
+                samples.setdefault(name, []).append(value)
+                speeds.setdefault(name, []).append(speed)
+    return samples, speeds
+
+
+def direction(name):
+    ''' +1 if bigger is better, -1 if smaller is better '''
+    return -1 if name.endswith('_ms') or name.endswith('.errors') else 1
+
+
+def compare(baseline, current, tolerance, latency_tolerance, spreads, noise_margin,
+            max_widening, min_latency_change):
+    ''' Print a per-metric diff, return the regressed metrics '''
+    regressed = []
+    print(f'{"metric":<44} {"baseline":>11} {"current":>11} {"change":>8}  status')
+    for name in sorted(set(baseline) | set(current)):
+        if name not in baseline or name not in current:
+            status = 'new' if name not in baseline else 'missing'
+            before = f'{baseline[name]:.2f}' if name in baseline else ''
+            after = f'{current[name]:.2f}' if name in current else ''
+            print(f'{name:<44} {before:>11} {after:>11} {"":>8}  {status}')
+            continue
+
+        before, after = baseline[name], current[name]
+        change = (after - before) / before if before else (0.0 if after == before else float('inf'))
+        limit = latency_tolerance if direction(name) < 0 else tolerance
+        limit = max(limit, min(noise_margin * spreads.get(name, 0.0), max_widening * limit))
+        worse = -change * direction(name)
+        if name.endswith('.errors'):
+            # any new error is a regression
+            status = 'REGRESSED' if after > before else 'ok'
+        elif name.endswith('_ms') and abs(after - before) < min_latency_change:
+            status = 'ok'
+        elif worse > limit:
+            status = 'REGRESSED'
+        elif worse < -limit:
+            status = 'improved'
+        else:
+            status = 'ok'
+        if status == 'REGRESSED':
+            regressed.append(name)
+        print(f'{name:<44} {before:>11.2f} {after:>11.2f} {change:>+8.1%}  {status}')
+    return regressed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Performance regression gate')
+    parser.add_argument('--baseline', type=Path, default=BASELINE)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='comma separated: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--runs', type=int, default=3, help='measured runs, the median counts')
+    parser.add_argument('--warmup-runs', type=int, default=1, help='runs thrown away first')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='allowed throughput drop, as a fraction')
+    parser.add_argument('--latency-tolerance', type=float, default=0.25,
+                        help='allowed p99 rise, as a fraction')
+    parser.add_argument('--noise-margin', type=float, default=2.0,
+                        help="times the baseline's spread a metric may move by")
+    parser.add_argument('--max-widening', type=float, default=2.0,
+                        help='the spread widens a tolerance to at most this many times it')
+    parser.add_argument('--confirm-rounds', type=int, default=1,
+                        help='times the scenarios of regressed metrics are run again')
+    parser.add_argument('--min-latency-change', type=float, default=1.0,
+                        help='p99 changes smaller than this are ignored, milliseconds')
+    parser.add_argument('--tmp-dir', type=Path, default=RAM_DIR if RAM_DIR.is_dir() else None,
+                        help='where the benchmark databases are created')
+    parser.add_argument('--update', action='store_true',
+                        help='save the measurements as the new baseline')
+    parser.add_argument('--force', action='store_true',
+                        help='gate even if the baseline is from another machine')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.tmp_dir is not None:
+        tempfile.tempdir = str(args.tmp_dir)
+    scenarios = args.scenarios.split(',')
+    samples, speeds = measure(scenarios, args.runs, args.warmup_runs)
+
+    if args.update:
+        # scenarios which weren't run keep their baseline, if it's from this machine
+        baseline = {'scenarios': {}, 'metrics': {}, 'spreads': {}}
+        if args.baseline.exists():
+            baseline = json.loads(args.baseline.read_text())
+            if baseline['machine'] != machine():
+                baseline = {'scenarios': {}, 'metrics': {}, 'spreads': {}}
+        baseline['recorded'] = time.strftime('%Y-%m-%d')
+        baseline['machine'] = machine()
+        baseline['runs'] = args.runs
+        # the speed is kept from the first recording on this machine,
+        # so that scenarios recorded later are scaled to the same one
+        baseline.setdefault('speed', statistics.median(
+            speed for values in speeds.values() for speed in values))
+        current, spreads = summarize(samples, speeds, baseline['speed'])
+        baseline['scenarios'].update({name: SCENARIOS[name] for name in scenarios})
+        for key, values in [('metrics', current), ('spreads', spreads)]:
+            baseline[key] = {
+                name: value for name, value in baseline.get(key, {}).items()
+                if name.split('.')[0] not in scenarios
+            }
+            baseline[key].update(values)
+        args.baseline.write_text(json.dumps(baseline, indent=4))
+        print(f'baseline saved to {args.baseline}')
+        return PASSED
+
+    baseline = json.loads(args.baseline.read_text())
+    for name in scenarios:
+        if baseline['scenarios'].get(name) != SCENARIOS[name]:
+            print(f'warning: the {name} scenario changed since the baseline was recorded')
+    metrics = {
+        name: value for name, value in baseline['metrics'].items()
+        if name.split('.')[0] in scenarios
+    }
+    print(f'baseline from {baseline["recorded"]} on {describe(baseline["machine"])}')
+    speed = statistics.median(speed for values in speeds.values() for speed in values)
+    print(f'the machine runs at {speed / baseline["speed"]:.0%} of its speed at the baseline, '
+          f'the numbers below are scaled to that speed')
+
+    def check():
+        current, _ = summarize(samples, speeds, baseline['speed'])
+        return compare(
+            metrics, current, args.tolerance, args.latency_tolerance,
+            baseline.get('spreads', {}), args.noise_margin, args.max_widening,
+            args.min_latency_change)
+
+    regressed = check()
+    if baseline['machine'] != machine() and not args.force:
+        print(f'not gated: this is {describe(machine())}, '
+              f'record a baseline here with --update, or pass --force')
+        return NOT_GATED
+    for _ in range(args.confirm_rounds):
+        if not regressed:
+            break
+        again = sorted({name.split('.')[0] for name in regressed})
+        print(f'{len(regressed)} metrics regressed, running {", ".join(again)} again')
+        more_samples, more_speeds = measure(again, args.runs, 0)
+        for name, values in more_samples.items():
+            samples[name].extend(values)
+            speeds[name].extend(more_speeds[name])
+        regressed = check()
+    if regressed:
+        print(f'{len(regressed)} metrics regressed: {", ".join(regressed)}')
+        return REGRESSED
+    print('no regressions')
+    return PASSED
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+''' End-to-end load test of the server.
+
+Starts the server against a fresh SQLite file in a temp directory, either
+in this process (init_app on the same event loop, handy for profiling) or
+as a subprocess running main.py (the client doesn't steal the server's
+loop), and drives it with simulated players. Every player logs in, looks
+at the items, buys and sells a few of them and logs out, over and over.
+
+Run from the server directory:
+    python -m bench.load --players 1000 --duration 30 --out results.json
+'''
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+
+from bench import percentile
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+
+# pause before logging in again after a failed login, seconds
+LOGIN_RETRY_DELAY = 0.05
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Stats:
+    def __init__(self):
+        # endpoint -> latencies in seconds
+        self.latencies = {}
+        self.errors = {}
+        self.refused = {}
+
+    def add(self, endpoint, duration, ok, refused):
+        self.latencies.setdefault(endpoint, []).append(duration)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        elif refused:
+            self.refused[endpoint] = self.refused.get(endpoint, 0) + 1
+
+    def report(self, duration):
+        endpoints = {}
+        for endpoint, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            endpoints[endpoint] = {
+                'requests': len(latencies),
+                'errors': self.errors.get(endpoint, 0),
+                'refused': self.refused.get(endpoint, 0),
+                'rps': len(latencies) / duration,
+                'p50_ms': percentile(latencies, 50) * 1e3,
+                'p95_ms': percentile(latencies, 95) * 1e3,
+                'p99_ms': percentile(latencies, 99) * 1e3,
+                'max_ms': latencies[-1] * 1e3,
+            }
+        requests = sum(e['requests'] for e in endpoints.values())
+        return {
+            'duration': duration,
+            'requests': requests,
+            'rps': requests / duration,
+            'errors': sum(e['errors'] for e in endpoints.values()),
+            'endpoints': endpoints,
+        }
+
+
+class Player:
+    def __init__(self, session, url, nickname, stats, args):
+        self.session = session
+        self.url = url
+        self.nickname = nickname
+        self.stats = stats
+        self.args = args
+        self.headers = {}
+
+    async def call(self, endpoint, data=None):
+        ''' Returns the json response, None on a transport or http error '''
+        before = time.perf_counter()
+        try:
+            if data is None:
+                response = await self.session.get(self.url + endpoint, headers=self.headers)
+            else:
+                response = await self.session.post(self.url + endpoint, json=data, headers=self.headers)
+            async with response:
+                ok = response.status == 200
+                res = await response.json() if ok else None
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            ok, res = False, None
+        self.stats.add(endpoint, time.perf_counter() - before, ok, ok and res.get('status') != 'ok')
+        return res
+
+    async def play(self, deadline):
+        while time.monotonic() < deadline:
+            res = await self.call('/login', {'nickname': self.nickname})
+            if res is None or res.get('status') != 'ok':
+                # don't spin on a failing login when there is no think time
+                await asyncio.sleep(max(self.args.think, LOGIN_RETRY_DELAY))
+                continue
+            self.headers = {'Authorization': 'Bearer ' + res['token']}
+
+            res = await self.call('/get_all_items')
+            items = list(res['data']) if res else []
+            res = await self.call('/get_my_items')
+            mine = list(res['data']) if res else []
+
+            for _ in range(self.args.trades):
+                if time.monotonic() >= deadline:
+                    break
+                if items and (not mine or random.random() < self.args.buy_ratio):
+                    item_id = random.choice(items)
+                    res = await self.call('/buy_item', {'id': item_id})
+                    if res and res.get('status') == 'ok':
+                        mine.append(int(item_id))
+                elif mine:
+                    await self.call('/sell_item', {'id': mine.pop(random.randrange(len(mine)))})
+                else:
+                    # nothing to buy or sell
+                    break
+                if random.random() < self.args.refresh_ratio:
+                    res = await self.call('/get_my_items')
+                    if res:
+                        mine = list(res['data'])
+                if self.args.think:
+                    await asyncio.sleep(random.uniform(0, 2 * self.args.think))
+
+            await self.call('/logout', {})
+            self.headers = {}
+
+
+async def wait_until_listening(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+
+
+def prepare_workdir(workdir, port, overrides):
+    ''' The server finds its config, items and db relative to the cwd '''
+    shutil.copytree(SERVER_DIR / 'data', workdir / 'data')
+    cfg_path = workdir / 'data' / 'server_config.json'
+    config = json.loads(cfg_path.read_text())
+    config.update(overrides, host='127.0.0.1', port=port)
+    cfg_path.write_text(json.dumps(config, indent=4))
+
+
+async def start_in_process(workdir):
+    import db
+    import main
+    from aiohttp import web
+    from config import ServerConfig
+
+    os.chdir(workdir)
+    db.sqlite_db = workdir / 'db.sqlite3'
+    config = ServerConfig()
+    main.init_globals(config)
+    db.migrate_db()
+    runner = web.AppRunner(await main.init_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, config.host, config.port).start()
+    return runner.cleanup
+
+
+async def start_subprocess(workdir):
+    process = subprocess.Popen([sys.executable, str(SERVER_DIR / 'main.py')], cwd=workdir)
+
+    async def stop():
+        process.terminate()
+        process.wait()
+
+    return stop
+
+
+async def run(args):
+    overrides = json.loads(args.config) if args.config else {}
+    port = free_port()
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        prepare_workdir(workdir, port, overrides)
+        cwd = os.getcwd()
+        if args.mode == 'inprocess':
+            stop = await start_in_process(workdir)
+        else:
+            stop = await start_subprocess(workdir)
+        try:
+            await wait_until_listening(port)
+            stats = Stats()
+            url = f'http://127.0.0.1:{port}'
+            connector = aiohttp.TCPConnector(limit=args.connections)
+            timeout = aiohttp.ClientTimeout(total=args.timeout)
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                players = [
+                    Player(session, url, f'player{i}', stats, args)
+                    for i in range(args.players)
+                ]
+                before = time.perf_counter()
+                deadline = time.monotonic() + args.duration
+                await asyncio.gather(*[player.play(deadline) for player in players])
+                duration = time.perf_counter() - before
+        finally:
+            await stop()
+            os.chdir(cwd)
+
+    result = stats.report(duration)
+    result['config'] = {
+        'mode': args.mode,
+        'players': args.players,
+        'connections': args.connections,
+        'duration': args.duration,
+        'trades': args.trades,
+        'buy_ratio': args.buy_ratio,
+        'refresh_ratio': args.refresh_ratio,
+        'think': args.think,
+        'server': overrides,
+    }
+    return result
+
+
+def print_report(result):
+    print(f'{"endpoint":<20} {"requests":>9} {"errors":>7} {"refused":>8} {"rps":>9} '
+          f'{"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+    for endpoint, e in result['endpoints'].items():
+        print(f'{endpoint:<20} {e["requests"]:>9} {e["errors"]:>7} {e["refused"]:>8} {e["rps"]:>9.1f} '
+              f'{e["p50_ms"]:>8.2f} {e["p95_ms"]:>8.2f} {e["p99_ms"]:>8.2f} {e["max_ms"]:>8.2f}')
+    print(f'{result["requests"]} requests in {result["duration"]:.1f}s, '
+          f'{result["rps"]:.1f} requests/s, {result["errors"]} errors')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Load test of the server')
+    parser.add_argument('--mode', choices=['subprocess', 'inprocess'], default='subprocess')
+    parser.add_argument('--players', type=int, default=1000)
+    parser.add_argument('--connections', type=int, default=100,
+                        help='client connections shared by the players')
+    parser.add_argument('--duration', type=float, default=30.0, help='seconds')
+    parser.add_argument('--trades', type=int, default=10, help='buys and sells per session')
+    parser.add_argument('--buy-ratio', type=float, default=0.6)
+    parser.add_argument('--refresh-ratio', type=float, default=0.2,
+                        help='chance to reload my items after a trade')
+    parser.add_argument('--think', type=float, default=0.0,
+                        help='mean pause between trades, seconds')
+    parser.add_argument('--timeout', type=float, default=30.0, help='per request, seconds')
+    parser.add_argument('--config', help='json object of server config overrides')
+    parser.add_argument('--out', help='save the results to this json file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.out:
+        Path(args.out).write_text(json.dumps(result, indent=4))
+    return result
+
+
+if __name__ == '__main__':
+    main()
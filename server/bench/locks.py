@@ -0,0 +1,92 @@
+''' Concurrency stress test of per-account serialization.
+
+Many players buy and sell concurrently through the db functions, each
+operation under the account's stripe of a StripedLock. Every operation
+checks that no other operation of its account is inside the lock with
+it, and at the end the totals are checked: no credits were lost or
+created and no balance went below zero. Run from the server directory: python -m bench.locks
+'''
+import asyncio
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import db
+from db import StripedLock
+
+
+ITEMS = {item_id: (item_id + 1) * 100 for item_id in range(20)}
+START_CREDITS = 5_000
+
+
+async def player(pool, locks, inside, account_id, operations):
+    for _ in range(operations):
+        item_id = random.choice(list(ITEMS))
+        async with locks.hold(account_id):
+            # operations of one account never overlap
+            inside[account_id] = inside.get(account_id, 0) + 1
+            assert inside[account_id] == 1, (account_id, inside[account_id])
+            try:
+                if random.random() < 0.6:
+                    await db.try_buy_item(pool, account_id, item_id, ITEMS[item_id])
+                else:
+                    await db.try_sell_item(pool, account_id, item_id, ITEMS[item_id])
+            finally:
+                inside[account_id] -= 1
+
+
+async def check_totals(pool, account_ids):
+    for account_id in account_ids:
+        credits = (await db.get_account_info(pool, account_id))['credits']
+        items = await db.get_my_items(pool, account_id)
+        assert credits >= 0, (account_id, credits)
+        assert credits + sum(ITEMS[i] for i in items) == START_CREDITS, (account_id, credits, items)
+
+
+async def scenario(name, accounts, players_per_account, operations, stripes=1024):
+    with tempfile.TemporaryDirectory() as tmp:
+        db.sqlite_db = Path(tmp) / 'db.sqlite3'
+        db.migrate_db()
+        pool = await db.open_pool(db.sqlite_db, 4)
+        try:
+            account_ids = []
+            for i in range(accounts):
+                account_id = await db.find_or_create_account(pool, f'player{i}')
+                await db.add_credits_to_account(pool, account_id, START_CREDITS)
+                account_ids.append(account_id)
+
+            locks = StripedLock(stripes)
+            # operations inside the lock by account
+            inside = {}
+            before = time.perf_counter()
+            await asyncio.gather(*[
+                player(pool, locks, inside, account_id, operations)
+                for account_id in account_ids
+                for _ in range(players_per_account)
+            ])
+            duration = time.perf_counter() - before
+            await check_totals(pool, account_ids)
+        finally:
+            await pool.close()
+
+    total = accounts * players_per_account * operations
+    stats = locks.stats()
+    print(f'{name:<28} {total:>8} ops  {total / duration:>8.0f}/s  '
+          f'contended {stats["contended"] / stats["acquired"]:>6.1%}  '
+          f'max wait {stats["max_wait"] * 1e3:>7.2f}ms')
+
+
+async def main(operations):
+    # one account hammered by many concurrent requests
+    await scenario('1 account x 200 requests', 1, 200, operations)
+    # many accounts, a few concurrent requests each
+    await scenario('200 accounts x 4 requests', 200, 4, operations)
+    # one request per account: accounts never wait for each other
+    await scenario('800 accounts x 1 request', 800, 1, operations)
+    print('operations were serialized, totals are consistent')
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20))
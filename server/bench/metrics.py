@@ -0,0 +1,91 @@
+''' Cost of recording metrics on the request path.
+
+Run from the server directory: python -m bench.metrics [count]
+'''
+import asyncio
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+from metrics import Metrics
+
+
+ROUTES = [
+    '/login', '/get_account_info', '/get_all_items', '/get_my_items',
+    '/buy_item', '/sell_item', '/logout', '/metrics', 'unmatched']
+
+
+def timed(name, count, fn):
+    before = time.perf_counter()
+    fn()
+    duration = time.perf_counter() - before
+    print(f'{name:<36} {count:>10}  {duration:>8.3f}s  {duration / max(count, 1) * 1e9:>8.0f} ns/op')
+    return duration
+
+
+def fake_request(route):
+    # just what the middleware looks at
+    resource = SimpleNamespace(canonical=route)
+    return SimpleNamespace(
+        match_info=SimpleNamespace(route=SimpleNamespace(resource=resource)),
+        method='POST')
+
+
+async def handler(request):
+    return SimpleNamespace(status=200)
+
+
+def bench_observe(count):
+    metrics = Metrics()
+    durations = [random.expovariate(200) for _ in range(count)]
+    routes = [random.choice(ROUTES) for _ in range(count)]
+    histogram = metrics.loop_lag
+
+    timed('histogram observe', count, lambda: [histogram.observe(d) for d in durations])
+    timed('observe_request', count, lambda: [
+        metrics.observe_request(route, 'POST', 200, d)
+        for route, d in zip(routes, durations)
+    ])
+    return metrics
+
+
+def bench_middleware(count):
+    metrics = Metrics()
+    middleware = metrics.middleware
+    requests = [fake_request(random.choice(ROUTES)) for _ in range(count)]
+
+    async def bare():
+        for request in requests:
+            await handler(request)
+
+    async def measured():
+        for request in requests:
+            await middleware(request, handler)
+
+    loop = asyncio.new_event_loop()
+    try:
+        base = timed('handler alone', count, lambda: loop.run_until_complete(bare()))
+        full = timed('handler through metrics middleware', count,
+                     lambda: loop.run_until_complete(measured()))
+    finally:
+        loop.close()
+    print(f'{"middleware overhead":<36} {count:>10}  {"":>9}  {(full - base) / count * 1e9:>8.0f} ns/op')
+
+
+def bench_render(metrics, scrapes=100):
+    metrics.collect('queue_depth', 'gauge', 'Queue depth.',
+                    lambda: {'writer': 0, 'readers': 0}, label='connection')
+    size = len(metrics.render())
+    timed(f'render ({size} bytes)', scrapes, lambda: [metrics.render() for _ in range(scrapes)])
+
+
+def main(count):
+    print(f'{"Metrics":<36} {"Count":>10}')
+    metrics = bench_observe(count)
+    bench_middleware(count)
+    bench_render(metrics)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,95 @@
+''' Memory and sweep cost of the session store.
+
+Run from the server directory: python -m bench.sessions [count]
+'''
+import sys
+import time
+import tracemalloc
+
+from session import SessionStore
+
+
+IDLE_TTL = 1800
+ABSOLUTE_TTL = 86400
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def timed(name, count, fn):
+    before = time.perf_counter()
+    result = fn()
+    duration = time.perf_counter() - before
+    print(f'{name:<36} {count:>10}  {duration:>8.3f}s  {duration / max(count, 1) * 1e9:>8.0f} ns/op')
+    return result
+
+
+def bench_memory(count):
+    store = SessionStore(IDLE_TTL, ABSOLUTE_TTL, clock=FakeClock())
+    tracemalloc.start()
+    for i in range(count):
+        store.create(i)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{"memory per session":<36} {count:>10}  {size / count:>8.0f} bytes')
+
+
+def bench_operations(count):
+    clock = FakeClock()
+    store = SessionStore(IDLE_TTL, ABSOLUTE_TTL, clock=clock)
+
+    timed('create', count, lambda: [store.create(i) for i in range(count)])
+    clock.now = 60
+    timed('touch', count, lambda: [store.touch(i) for i in range(count)])
+    timed('contains', count, lambda: [i in store for i in range(count)])
+    timed('sweep, nothing due', 1, store.sweep)
+
+    # every entry is due at once: a hundredth of the sessions stayed idle,
+    # the others were refreshed and go back to the heap
+    idle = count // 100
+    clock.now = IDLE_TTL + 50
+    for i in range(idle, count):
+        store.touch(i)
+    clock.now = IDLE_TTL + 1000
+    removed = timed('sweep, all due, 1% expired', count, store.sweep)
+    assert removed == idle, removed
+
+    clock.now = ABSOLUTE_TTL
+    timed('sweep, all expired', count - idle, store.sweep)
+    assert len(store) == 0, len(store)
+
+
+def bench_steady_sweep(count, seconds=60):
+    # logins spread evenly over the idle ttl, so every second
+    # about count / IDLE_TTL sessions expire
+    clock = FakeClock()
+    store = SessionStore(IDLE_TTL, ABSOLUTE_TTL, clock=clock)
+    for i in range(count):
+        clock.now = i * IDLE_TTL / count
+        store.create(i)
+
+    removed = 0
+    duration = 0.0
+    for second in range(seconds):
+        clock.now = IDLE_TTL + second
+        before = time.perf_counter()
+        removed += store.sweep()
+        duration += time.perf_counter() - before
+    print(f'{"sweep every 1s, steady state":<36} {count:>10}  '
+          f'{duration / seconds * 1e3:>7.3f}ms  {removed // seconds:>6} expired/sweep')
+
+
+def main(count):
+    print(f'{"Session store":<36} {"Sessions":>10}')
+    bench_memory(count)
+    bench_operations(count)
+    bench_steady_sweep(count)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
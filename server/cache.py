@@ -0,0 +1,99 @@
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    ''' Bounded mapping which drops the least recently used entries '''
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+class AccountCache(LRUCache):
+    ''' Account info by account_id, kept up to date by the writes.
+
+    A miss is filled by a read which may race with a write to the same
+    account, so the read takes a ticket first, and a write in between
+    cancels the ticket instead of letting a stale result into the cache '''
+
+    def __init__(self, maxsize):
+        super().__init__(maxsize)
+        self._tickets = {}
+
+    def begin_fill(self, account_id):
+        ticket = self._tickets[account_id] = object()
+        return ticket
+
+    def end_fill(self, account_id, ticket, account_info):
+        if self._tickets.get(account_id) is ticket:
+            del self._tickets[account_id]
+            if account_info is not None:
+                self.put(account_id, dict(account_info))
+
+    def put_fresh(self, account_id, account_info):
+        ''' Store account info that was read by the writer itself '''
+        self._tickets.pop(account_id, None)
+        self.put(account_id, dict(account_info))
+
+    def add_credits(self, account_id, amount_of_credits):
+        self._tickets.pop(account_id, None)
+        account_info = self._data.get(account_id)
+        if account_info is not None:
+            account_info['credits'] += amount_of_credits
+
+
+class TokenCache(LRUCache):
+    ''' account_id by already verified token, so repeated requests with the
+    same token skip the signature check and the claims parsing '''
+
+    def get_account_id(self, token):
+        entry = self.get(token)
+        if entry is None:
+            return None
+        account_id, exp = entry
+        if exp is not None and exp < time.time():
+            # expired, let jwt.decode reject it
+            self._data.pop(token, None)
+            self.hits -= 1
+            self.misses += 1
+            return None
+        return account_id
+
+    def put_token(self, token, payload):
+        self.put(token, (payload['account_id'], payload.get('exp')))
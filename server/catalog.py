@@ -0,0 +1,69 @@
+import gzip
+import hashlib
+import json
+import zlib
+from aiohttp import hdrs, web
+
+
+class EncodedJson:
+    ''' JSON document which never changes: it is serialized and compressed
+    once, so that every response just sends the cached bytes '''
+
+    # preferred first
+    encodings = ('gzip', 'deflate')
+
+    def __init__(self, data):
+        identity = json.dumps(data).encode('utf-8')
+        self.bodies = {
+            None: identity,
+            'gzip': gzip.compress(identity, 9),
+            'deflate': zlib.compress(identity, 9)
+        }
+        # a strong validator has to differ between encodings of the document
+        digest = hashlib.sha256(identity).hexdigest()[:32]
+        self.etags = {
+            encoding: f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+            for encoding in self.bodies
+        }
+
+    def pick_encoding(self, accept_encoding):
+        accepted = set()
+        # q=0 excludes a coding, even when * would allow it
+        refused = set()
+        for item in accept_encoding.split(','):
+            name, _, params = item.partition(';')
+            name = name.strip().lower()
+            params = params.replace(' ', '')
+            if params.startswith('q='):
+                try:
+                    if float(params[2:]) <= 0:
+                        refused.add(name)
+                        continue
+                except ValueError:
+                    continue
+            accepted.add(name)
+        for encoding in self.encodings:
+            if encoding in accepted:
+                return encoding
+        for encoding in self.encodings:
+            if '*' in accepted and encoding not in refused:
+                return encoding
+        return None
+
+    def response(self, request):
+        encoding = self.pick_encoding(request.headers.get(hdrs.ACCEPT_ENCODING, ''))
+        etag = self.etags[encoding]
+        headers = {hdrs.ETAG: etag, hdrs.VARY: hdrs.ACCEPT_ENCODING}
+
+        # 304 only answers a conditional GET or HEAD
+        if_none_match = request.headers.get(hdrs.IF_NONE_MATCH)
+        if if_none_match is not None and request.method in (hdrs.METH_GET, hdrs.METH_HEAD):
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            if etag in tags or '*' in tags:
+                return web.Response(status=304, headers=headers)
+
+        if encoding is not None:
+            headers[hdrs.CONTENT_ENCODING] = encoding
+        return web.Response(
+            body=self.bodies[encoding], headers=headers,
+            content_type='application/json')
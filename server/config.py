@@ -12,6 +12,37 @@ class ServerConfig:
     credits_range_end: int
     host: str
     port: int
+    db_readers: int
+    group_commit: bool
+    group_commit_window_ms: float
+    group_commit_max_batch: int
+    account_cache_size: int
+    token_cache_size: int
+    session_idle_ttl: float
+    session_absolute_ttl: float
+    session_sweep_interval: float
+    workers: int
+    account_lock_stripes: int
+    max_inflight: int
+    route_inflight_limits: dict
+    rate_limit_per_second: float
+    rate_limit_burst: int
+    retry_after: int
+    server_timing: bool
+    slow_request_threshold: float
+    slow_request_sample_rate: float
+    db_stats: bool
+    loop_stall_threshold: float
+    loop_stall_log_interval: float
+    admin_token: str
+    profile_max_seconds: float
+    access_log_async: bool
+    access_log_sample_rate: float
+    access_log_buffer: int
+    batch_max_ops: int
+    session_busy_timeout: float
+    access_log_format: str
+    worker_shutdown_timeout: float
 
     def __init__(self):
         try:
@@ -35,14 +66,79 @@ class ServerConfig:
         self.credits_range_end = 100_000
         self.host = 'localhost'
         self.port = 1234
+        self.db_readers = 4
+        self.group_commit = False
+        self.group_commit_window_ms = 2.0
+        self.group_commit_max_batch = 64
+        self.account_cache_size = 100_000
+        self.token_cache_size = 100_000
+        self.session_idle_ttl = 1800.0
+        self.session_absolute_ttl = 86400.0
+        self.session_sweep_interval = 1.0
+        self.workers = 1
+        self.account_lock_stripes = 1024
+        self.max_inflight = 1000
+        self.route_inflight_limits = {}
+        self.rate_limit_per_second = 0.0
+        self.rate_limit_burst = 20
+        self.retry_after = 1
+        self.server_timing = False
+        self.slow_request_threshold = 0.5
+        self.slow_request_sample_rate = 0.1
+        self.db_stats = False
+        self.loop_stall_threshold = 0.1
+        self.loop_stall_log_interval = 10.0
+        self.admin_token = ''
+        self.profile_max_seconds = 60.0
+        self.access_log_async = False
+        self.access_log_sample_rate = 1.0
+        self.access_log_buffer = 10_000
+        self.batch_max_ops = 20
+        self.session_busy_timeout = 0.05
+        self.access_log_format = '%a %t "%r" %s %b "%{Referer}i" "%{User-Agent}i"'
+        self.worker_shutdown_timeout = 10.0
 
     def read_config(self):
         with cfg_path.open('r') as f:
             data = json.load(f)
+
+        # optional settings keep their defaults when absent in the file
+        self.init_defaults()
         self.credits_range_begin = int(data['credits_range_begin'])
         self.credits_range_end = int(data['credits_range_end'])
         self.host = data['host']
         self.port = int(data['port'])
+        self.db_readers = int(data.get('db_readers', self.db_readers))
+        self.group_commit = bool(data.get('group_commit', self.group_commit))
+        self.group_commit_window_ms = float(data.get('group_commit_window_ms', self.group_commit_window_ms))
+        self.group_commit_max_batch = int(data.get('group_commit_max_batch', self.group_commit_max_batch))
+        self.account_cache_size = int(data.get('account_cache_size', self.account_cache_size))
+        self.token_cache_size = int(data.get('token_cache_size', self.token_cache_size))
+        self.session_idle_ttl = float(data.get('session_idle_ttl', self.session_idle_ttl))
+        self.session_absolute_ttl = float(data.get('session_absolute_ttl', self.session_absolute_ttl))
+        self.session_sweep_interval = float(data.get('session_sweep_interval', self.session_sweep_interval))
+        self.workers = int(data.get('workers', self.workers))
+        self.account_lock_stripes = int(data.get('account_lock_stripes', self.account_lock_stripes))
+        self.max_inflight = int(data.get('max_inflight', self.max_inflight))
+        self.route_inflight_limits = dict(data.get('route_inflight_limits', self.route_inflight_limits))
+        self.rate_limit_per_second = float(data.get('rate_limit_per_second', self.rate_limit_per_second))
+        self.rate_limit_burst = int(data.get('rate_limit_burst', self.rate_limit_burst))
+        self.retry_after = int(data.get('retry_after', self.retry_after))
+        self.server_timing = bool(data.get('server_timing', self.server_timing))
+        self.slow_request_threshold = float(data.get('slow_request_threshold', self.slow_request_threshold))
+        self.slow_request_sample_rate = float(data.get('slow_request_sample_rate', self.slow_request_sample_rate))
+        self.db_stats = bool(data.get('db_stats', self.db_stats))
+        self.loop_stall_threshold = float(data.get('loop_stall_threshold', self.loop_stall_threshold))
+        self.loop_stall_log_interval = float(data.get('loop_stall_log_interval', self.loop_stall_log_interval))
+        self.admin_token = str(data.get('admin_token', self.admin_token))
+        self.profile_max_seconds = float(data.get('profile_max_seconds', self.profile_max_seconds))
+        self.access_log_async = bool(data.get('access_log_async', self.access_log_async))
+        self.access_log_sample_rate = float(data.get('access_log_sample_rate', self.access_log_sample_rate))
+        self.access_log_buffer = int(data.get('access_log_buffer', self.access_log_buffer))
+        self.batch_max_ops = int(data.get('batch_max_ops', self.batch_max_ops))
+        self.session_busy_timeout = float(data.get('session_busy_timeout', self.session_busy_timeout))
+        self.access_log_format = str(data.get('access_log_format', self.access_log_format))
+        self.worker_shutdown_timeout = float(data.get('worker_shutdown_timeout', self.worker_shutdown_timeout))
 
     def write_config(self):
         with cfg_path.open('w') as f:
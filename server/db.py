@@ -1,122 +1,380 @@
 import aiosqlite
+import asyncio
+import contextvars
+import logging
 import sqlite3
+import time
+from contextlib import asynccontextmanager, closing
+from itertools import cycle
 from pathlib import Path
 
+from cache import AccountCache, LRUCache
+from migrations import migrate
+from phases import phase
+
+
+LOG = logging.getLogger('server.db')
 
 sqlite_db = Path('db.sqlite3')
 
 
+class StripedLock:
+    ''' Fixed array of asyncio locks, a key always maps to the same lock:
+    operations on one account are serialized, while different accounts
+    proceed in parallel (unless they happen to share a stripe) '''
+
+    def __init__(self, stripes):
+        self._locks = [asyncio.Lock() for _ in range(stripes)]
+        # tasks holding or waiting for each lock
+        self._users = [0] * stripes
+        self.acquired = 0
+        self.contended = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    @asynccontextmanager
+    async def hold(self, key):
+        index = hash(key) % len(self._locks)
+        lock = self._locks[index]
+        self.acquired += 1
+        self._users[index] += 1
+        try:
+            if self._users[index] > 1:
+                self.contended += 1
+                before = time.perf_counter()
+                await lock.acquire()
+                wait = time.perf_counter() - before
+                self.wait_time += wait
+                self.max_wait = max(self.max_wait, wait)
+            else:
+                await lock.acquire()
+            try:
+                yield
+            finally:
+                lock.release()
+        finally:
+            self._users[index] -= 1
+
+    def stats(self):
+        return {
+            'stripes': len(self._locks),
+            'acquired': self.acquired,
+            'contended': self.contended,
+            'wait_time': self.wait_time,
+            'max_wait': self.max_wait
+        }
+
+
+class GroupCommitter:
+    ''' Commits writes of concurrent handlers together: writes that arrive
+    within a window (or up to a max batch) share one transaction, while
+    each of them is isolated by a savepoint and succeeds or fails alone '''
+
+    def __init__(self, writer, window, max_batch):
+        self.writer = writer
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []
+        self._timer = None
+        self._commits = set()
+
+    async def write(self, fn, *args):
+        future = asyncio.get_event_loop().create_future()
+        self._pending.append((fn, args, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_event_loop().call_later(self.window, self._flush)
+        with phase('group_commit'):
+            return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            # the commit serves the whole batch, so it doesn't run in the
+            # context of the request which happened to flush it
+            task = contextvars.Context().run(asyncio.ensure_future, self._commit(batch))
+            self._commits.add(task)
+            task.add_done_callback(self._commits.discard)
+
+    async def _commit(self, batch):
+        calls = [(fn, args) for fn, args, _ in batch]
+        try:
+            outcomes = await self.writer.run_in_thread(_run_group, calls)
+        except Exception as e:
+            # the commit itself failed, so did every write of the batch
+            outcomes = [(e, None)] * len(batch)
+        for (_, _, future), (exception, result) in zip(batch, outcomes):
+            if future.done():
+                continue
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+
+    async def close(self):
+        self._flush()
+        if self._commits:
+            await asyncio.wait(self._commits)
+
+
+def _run_group(conn, calls):
+    outcomes = []
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for fn, args in calls:
+            conn.execute('SAVEPOINT write')
+            try:
+                outcomes.append((None, fn(conn, *args)))
+            except Exception as e:
+                conn.execute('ROLLBACK TO write')
+                outcomes.append((e, None))
+            conn.execute('RELEASE write')
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return outcomes
+
+
+class DbPool:
+    ''' One writer connection for mutations and N read-only connections '''
+
+    def __init__(self, writer, readers, group_committer=None, account_cache_size=0):
+        self.writer = writer
+        self.readers = readers
+        self.group_committer = group_committer
+        # account info by account_id and account_id by lowercase nickname
+        self.accounts = AccountCache(account_cache_size)
+        self.account_ids = LRUCache(account_cache_size)
+        self._next_reader = cycle(readers or [writer])
+
+    def reader(self):
+        return next(self._next_reader)
+
+    async def write(self, fn, *args):
+        ''' Run fn(conn, *args) as one transaction on the writer's thread,
+        so concurrent handlers never commit each other's half-done work;
+        fn must not commit or roll back itself '''
+        if self.group_committer is not None:
+            return await self.group_committer.write(fn, *args)
+        return await self.writer.run_in_transaction(fn, *args)
+
+    async def read(self, fn, *args):
+        return await self.reader().run_in_thread(fn, *args)
+
+    def enable_stats(self):
+        for db in [self.writer, *self.readers]:
+            db.enable_stats()
+
+    def query_stats(self):
+        ''' Statement statistics of all the connections together '''
+        return aiosqlite.QueryStats.combine(
+            db.stats for db in [self.writer, *self.readers] if db.stats is not None)
+
+    def set_timing_hook(self, hook):
+        for db in [self.writer, *self.readers]:
+            db.timing_hook = hook
+
+    def queue_depth(self):
+        ''' Calls waiting for the connection threads '''
+        return {
+            'writer': self.writer.queue_size,
+            'readers': sum(db.queue_size for db in self.readers)
+        }
+
+    async def close(self):
+        if self.group_committer is not None:
+            await self.group_committer.close()
+        for db in self.readers:
+            await db.close()
+        await self.writer.close()
+
+
+async def open_pool(path, readers_count, group_commit=False,
+                    group_commit_window=0.002, group_commit_max_batch=64,
+                    account_cache_size=0):
+    # the writer goes first: it switches the db into WAL mode,
+    # so that readers are never blocked by the writer and vice versa
+    writer = await aiosqlite.connect(path)
+    writer.row_factory = aiosqlite.Row
+    async with writer.execute('PRAGMA journal_mode=WAL'):
+        pass
+
+    readers = []
+    for _ in range(readers_count):
+        reader = await aiosqlite.connect(
+            Path(path).resolve().as_uri() + '?mode=ro', uri=True)
+        reader.row_factory = aiosqlite.Row
+        readers.append(reader)
+
+    group_committer = None
+    if group_commit:
+        group_committer = GroupCommitter(
+            writer, group_commit_window, group_commit_max_batch)
+
+    return DbPool(writer, readers, group_committer, account_cache_size)
+
+
 async def init_db(app):
-    db = await aiosqlite.connect(sqlite_db)
-    db.row_factory = aiosqlite.Row
-    app['DB'] = db
+    config = app['CONFIG']
+    # other processes change the accounts too, a local cache would go stale
+    account_cache_size = config.account_cache_size if config.workers <= 1 else 0
+    pool = await open_pool(
+        sqlite_db, config.db_readers, config.group_commit,
+        config.group_commit_window_ms / 1000, config.group_commit_max_batch,
+        account_cache_size)
+    if config.db_stats:
+        pool.enable_stats()
+    app['DB'] = pool
     yield
-    await db.close()
-
-
-def try_make_db():
-    if sqlite_db.exists():
-        return
-
-    with sqlite3.connect(sqlite_db) as conn:
-        cur = conn.cursor()
-        cur.execute(
-            '''CREATE TABLE IF NOT EXISTS Accounts (
-            nickname TEXT NOT NULL,
-            credits INTEGER DEFAULT 0)
-            '''
-        )
-        cur.execute(
-            '''CREATE TABLE IF NOT EXISTS Items (
-            account_id INTEGER NOT NULL,
-            item_id INTEGER NOT NULL)
-            '''
-        )
-        conn.commit()
+    if config.db_stats:
+        LOG.info('query stats:\n%s', pool.query_stats().table())
+    await pool.close()
 
 
-async def find_or_create_account(db, nickname):
-    async with db.execute(
-        'SELECT rowid FROM Accounts WHERE nickname = ? COLLATE NOCASE', [nickname]
-    ) as cursor:
-        row = await cursor.fetchone()
-        if row is not None:
-            return row['rowid']
-    async with db.execute('INSERT INTO Accounts (nickname) VALUES (?)', [nickname]) as cursor:
-        # sqlite doesn't support a RETURNING sql-keyword, using lastrowid instead
-        account_id = cursor.lastrowid
-    await db.commit()
-    return account_id
+def migrate_db():
+    ''' Create the database if it doesn't exist and upgrade its schema '''
+    with closing(sqlite3.connect(sqlite_db)) as conn:
+        migrate(conn)
+
+
+# the functions below run on a connection's thread with a sqlite3 connection,
+# each of them is a single round trip for the event loop; results are fetched
+# to the end, since an unfinished statement would block the commit
+
+
+def _find_or_create_account(conn, nickname):
+    rows = conn.execute(
+        'SELECT rowid FROM Accounts WHERE nickname = ? COLLATE NOCASE', [nickname]).fetchall()
+    if rows:
+        return rows[0]['rowid']
+    # sqlite doesn't support a RETURNING sql-keyword, using lastrowid instead
+    return conn.execute('INSERT INTO Accounts (nickname) VALUES (?)', [nickname]).lastrowid
 
 
-async def add_credits_to_account(db, account_id, amount_of_credits):
-    await db.execute(
+def _add_credits_to_account(conn, account_id, amount_of_credits):
+    conn.execute(
         'UPDATE Accounts SET credits = credits + ? WHERE rowid = ?', [amount_of_credits, account_id])
-    await db.commit()
-
-
-async def try_buy_item(db, account_id, item_id, item_price):
-    # check that item was not already purchased
-    async with db.execute(
-        'SELECT rowid FROM Items WHERE account_id = ? AND item_id = ?', [account_id, item_id]
-    ) as cursor:
-        row = await cursor.fetchone()
-        if row is not None:
-            return False, 'Item was already purchased!'
-
-    # check that there are enough credits for the purchase
-    async with db.execute(
-        'SELECT credits FROM Accounts WHERE rowid = ?', [account_id]
-    ) as cursor:
-        row = await cursor.fetchone()
-        credits = int(row['credits'])
-    if credits < item_price:
-        return False, 'Not enough credits to buy item!'
-
-    await db.execute(
+
+
+def _add_credits_and_get_account_info(conn, account_id, amount_of_credits):
+    _add_credits_to_account(conn, account_id, amount_of_credits)
+    return _get_account_info(conn, account_id)
+
+
+def _account_state(conn, account_id, with_items):
+    # read by the trade's own transaction, so it's exactly what it left
+    state = {'account': _get_account_info(conn, account_id)}
+    if with_items:
+        state['items'] = _get_my_items(conn, account_id)
+    return state
+
+
+def _try_buy_item(conn, account_id, item_id, item_price, with_items=False):
+    # the item is given only when there are enough credits, and
+    # the unique index on (account_id, item_id) ignores a second purchase
+    cursor = conn.execute(
+        'INSERT OR IGNORE INTO Items (account_id, item_id) '
+        'SELECT ?, ? FROM Accounts WHERE rowid = ? AND credits >= ?',
+        [account_id, item_id, account_id, item_price])
+    if cursor.rowcount == 0:
+        owned = conn.execute(
+            'SELECT 1 FROM Items WHERE account_id = ? AND item_id = ?', [account_id, item_id]).fetchall()
+        if owned:
+            return False, 'Item was already purchased!', None
+        return False, 'Not enough credits to buy item!', None
+
+    # nothing can run in between on the writer's thread, credits are enough
+    conn.execute(
         'UPDATE Accounts SET credits = credits - ? WHERE rowid = ?', [item_price, account_id])
-    await db.execute('INSERT INTO Items (account_id, item_id) VALUES (?, ?)', [account_id, item_id])
-    await db.commit()
 
-    return True, 'Item was purchased successfully.'
+    return True, 'Item was purchased successfully.', _account_state(conn, account_id, with_items)
 
 
-async def try_sell_item(db, account_id, item_id, item_price):
-    # check that item was not already purchased
-    async with db.execute(
-        'SELECT rowid FROM Items WHERE account_id = ? AND item_id = ?', [account_id, item_id]
-    ) as cursor:
-        row = await cursor.fetchone()
-        if row is None:
-            return False, 'There is no such item in account!'
-        rowid = row['rowid']
+def _try_sell_item(conn, account_id, item_id, item_price, with_items=False):
+    # the item is checked and removed by the same statement
+    cursor = conn.execute(
+        'DELETE FROM Items WHERE account_id = ? AND item_id = ?', [account_id, item_id])
+    if cursor.rowcount == 0:
+        return False, 'There is no such item in account!', None
 
-    await db.execute('DELETE FROM Items WHERE rowid = ?', [rowid])
-    await db.execute(
+    conn.execute(
         'UPDATE Accounts SET credits = credits + ? WHERE rowid = ?', [item_price, account_id])
-    await db.commit()
 
-    return True, 'Item was sold successfully.'
+    return True, 'Item was sold successfully.', _account_state(conn, account_id, with_items)
 
 
-async def get_my_items(db, account_id):
-    items = []
-    async with db.execute(
-        'SELECT item_id FROM Items WHERE account_id = ?', [account_id]
-    ) as cursor:
-        records = await cursor.fetchall()
-        for row in records:
-            items.append(row['item_id'])
-    return items
+def _get_my_items(conn, account_id):
+    return [row['item_id'] for row in conn.execute(
+        'SELECT item_id FROM Items WHERE account_id = ?', [account_id])]
 
 
-async def get_account_info(db, account_id):
+def _get_account_info(conn, account_id):
     # no checks there
-    async with db.execute('SELECT * FROM Accounts WHERE rowid = ?', [account_id]) as cursor:
-        row = await cursor.fetchone()
-        nickname = row['nickname']
-        credits = row['credits']
-        return {
-            'nickname': nickname,
-            'credits': credits
-        }
+    (row,) = conn.execute('SELECT * FROM Accounts WHERE rowid = ?', [account_id]).fetchall()
+    return {
+        'nickname': row['nickname'],
+        'credits': row['credits']
+    }
+
+
+async def find_or_create_account(pool, nickname):
+    # nicknames are ascii-only and compared with NOCASE
+    key = nickname.lower()
+    account_id = pool.account_ids.get(key)
+    if account_id is None:
+        account_id = await pool.write(_find_or_create_account, nickname)
+        pool.account_ids.put(key, account_id)
+    return account_id
+
+
+async def add_credits_to_account(pool, account_id, amount_of_credits):
+    await pool.write(_add_credits_to_account, account_id, amount_of_credits)
+    pool.accounts.add_credits(account_id, amount_of_credits)
+
+
+async def add_credits_and_get_account_info(pool, account_id, amount_of_credits):
+    account_info = await pool.write(_add_credits_and_get_account_info, account_id, amount_of_credits)
+    pool.accounts.put_fresh(account_id, account_info)
+    return account_info
+
+
+async def try_buy_item(pool, account_id, item_id, item_price, with_items=False):
+    ''' Returns (ok, msg, state), on success state has the account info
+    after the purchase and, if asked, the items owned after it '''
+    ok, msg, state = await pool.write(
+        _try_buy_item, account_id, item_id, item_price, with_items)
+    if ok:
+        pool.accounts.put_fresh(account_id, state['account'])
+    return ok, msg, state
+
+
+async def try_sell_item(pool, account_id, item_id, item_price, with_items=False):
+    ''' Same as try_buy_item '''
+    ok, msg, state = await pool.write(
+        _try_sell_item, account_id, item_id, item_price, with_items)
+    if ok:
+        pool.accounts.put_fresh(account_id, state['account'])
+    return ok, msg, state
+
+
+async def get_my_items(pool, account_id):
+    return await pool.read(_get_my_items, account_id)
+
+
+async def get_account_info(pool, account_id):
+    account_info = pool.accounts.get(account_id)
+    if account_info is not None:
+        return dict(account_info)
+
+    ticket = pool.accounts.begin_fill(account_id)
+    account_info = None
+    try:
+        account_info = await pool.read(_get_account_info, account_id)
+    finally:
+        pool.accounts.end_fill(account_id, ticket, account_info)
+    return account_info
@@ -0,0 +1,124 @@
+import asyncio
+import collections
+import os
+import secrets
+import sys
+import threading
+import time
+import tracemalloc
+from aiohttp import hdrs, web
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def sample_stacks(thread_id, seconds, interval):
+    ''' Count the stacks a thread is seen in, root frame first '''
+    stacks = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        names = []
+        while frame is not None:
+            names.append(frame_name(frame))
+            frame = frame.f_back
+        if names:
+            stacks[';'.join(reversed(names))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+class Debug:
+    ''' Admin-only endpoints to look into the running server: a sampling
+    profiler of the event loop thread and tracemalloc snapshot diffs '''
+
+    def __init__(self, admin_token, max_profile_seconds=60.0, sample_interval=0.005):
+        self.admin_token = admin_token
+        self.max_profile_seconds = max_profile_seconds
+        self.sample_interval = sample_interval
+        self._profiling = False
+        self._snapshot = None
+
+    def routes(self):
+        return [
+            web.get('/debug/profile', self.profile_handle),
+            web.get('/debug/tracemalloc', self.tracemalloc_handle)
+        ]
+
+    def is_admin(self, request):
+        scheme, _, token = request.headers.get(hdrs.AUTHORIZATION, '').partition(' ')
+        return (bool(self.admin_token) and scheme.lower() == 'bearer'
+                and secrets.compare_digest(token.strip(), self.admin_token))
+
+    def error(self, status, msg):
+        res = {'status': 'error', 'data': msg}
+        return web.json_response(res, status=status)
+
+    async def profile_handle(self, request):
+        ''' Collapsed stacks of the event loop thread, one "frame;frame;... count"
+        line per stack, for flamegraph.pl or speedscope '''
+        if not self.is_admin(request):
+            return self.error(403, 'Forbidden!')
+
+        try:
+            seconds = float(request.query.get('seconds', 10))
+        except ValueError:
+            seconds = -1
+        if not 0 < seconds <= self.max_profile_seconds:
+            return self.error(400, f'seconds must be in (0, {self.max_profile_seconds}]!')
+        if self._profiling:
+            return self.error(409, 'Already profiling!')
+
+        self._profiling = True
+        try:
+            loop = asyncio.get_event_loop()
+            stacks = await loop.run_in_executor(
+                None, sample_stacks, threading.get_ident(), seconds, self.sample_interval)
+        finally:
+            self._profiling = False
+
+        lines = [f'{stack} {count}' for stack, count in stacks.most_common()]
+        return web.Response(text='\n'.join(lines) + '\n')
+
+    async def tracemalloc_handle(self, request):
+        ''' The first call starts tracing, every next one shows what grew since
+        the previous call; ?stop=1 stops tracing '''
+        if not self.is_admin(request):
+            return self.error(403, 'Forbidden!')
+
+        try:
+            frames = int(request.query.get('frames', 1))
+            limit = int(request.query.get('limit', 25))
+        except ValueError:
+            return self.error(400, 'frames and limit must be integers!')
+
+        group_by = request.query.get('group_by', 'lineno')
+        if group_by not in ('filename', 'lineno', 'traceback'):
+            return self.error(400, 'group_by must be filename, lineno or traceback!')
+
+        if request.query.get('stop'):
+            tracemalloc.stop()
+            self._snapshot = None
+            return web.Response(text='tracemalloc stopped\n')
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            self._snapshot = None
+
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ])
+        previous, self._snapshot = self._snapshot, snapshot
+        if previous is None:
+            return web.Response(text='tracemalloc started, call again to see the growth\n')
+
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f'traced: {current / 2**20:.1f} MiB, peak: {peak / 2**20:.1f} MiB']
+        for stat in snapshot.compare_to(previous, group_by)[:limit]:
+            lines.append(str(stat))
+            if group_by == 'traceback':
+                lines.extend(stat.traceback.format())
+        return web.Response(text='\n'.join(lines) + '\n')
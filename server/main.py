@@ -1,19 +1,39 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
 import random
 import re
 import secrets
+import signal
+import time
 import jwt
 import json
-from aiohttp import web
+from aiohttp import hdrs, web
+from aiohttp.log import access_logger
 from pathlib import Path
 
 from db import (
-    init_db, try_make_db, find_or_create_account,
-    add_credits_to_account, get_account_info,
+    StripedLock, init_db, migrate_db, find_or_create_account,
+    add_credits_and_get_account_info, get_account_info,
     get_my_items, try_buy_item, try_sell_item)
-from session import Session
+from session import SessionStore, SessionsBusy, SharedSessionStore, sessions_db
+from catalog import EncodedJson
+from cache import TokenCache
+from admission import AdmissionControl
+from metrics import Metrics
+from monitor import LoopMonitor
+from debug import Debug
+from accesslog import AccessLogWriter
+from phases import phase, record_db_call
+from timing import Timing, json_response
 from config import ServerConfig
 
 
+LOG = logging.getLogger('server')
+
 nickname_re = re.compile(r'[a-z0-9_]{3,20}', re.I)
 
 
@@ -21,9 +41,74 @@ def check_nickname(nickname):
     return re.fullmatch(nickname_re, nickname) is not None
 
 
+# routes which don't need an authenticated session
+# debug endpoints check the admin token themselves
+public_paths = {'/login', '/metrics', '/debug/profile', '/debug/tracemalloc'}
+
+
+async def get_request_json(request):
+    ''' Parse the json body at most once per request '''
+    if 'json' not in request:
+        with phase('parse'):
+            request['json'] = await request.json()
+    return request['json']
+
+
+async def get_request_token(request):
+    scheme, _, token = request.headers.get(hdrs.AUTHORIZATION, '').partition(' ')
+    if scheme.lower() == 'bearer':
+        return token.strip()
+
+    # clients which still send the token in the json body
+    if request.method == 'POST' and request.body_exists:
+        data = await get_request_json(request)
+        return data['token']
+
+    return None
+
+
+@web.middleware
+async def auth_middleware(request, handler):
+    ''' Authenticate the session before any handler runs, so handlers
+    find the account in request['account_id'] '''
+    if request.path in public_paths or request.match_info.http_exception is not None:
+        return await handler(request)
+
+    try:
+        token = await get_request_token(request)
+        with phase('auth'):
+            account_id = get_account_id_from_token(token)
+    except Exception:
+        res = {'status': 'error', 'data': 'Invalid token!'}
+        return json_response(res, status=401)
+
+    # refresh the session on every authenticated request
+    try:
+        with phase('auth'):
+            touched = g_sessions.touch(account_id)
+    except SessionsBusy:
+        return g_admission.busy_response()
+    if not touched:
+        res = {'status': 'error', 'data': 'Session not found!'}
+        return json_response(res, status=401)
+
+    request['token'] = token
+    request['account_id'] = account_id
+    return await handler(request)
+
+
+def serialized_per_account(op):
+    ''' Mutating operations of one account run one at a time '''
+    @functools.wraps(op)
+    async def wrapper(db, account_id, args):
+        async with g_account_locks.hold(account_id):
+            return await op(db, account_id, args)
+    return wrapper
+
+
 async def login_handle(request):
     try:
-        data = await request.json()
+        data = await get_request_json(request)
 
         # unpack nickname
         nickname = data['nickname']
@@ -31,28 +116,27 @@ async def login_handle(request):
         # validate user-input
         if not check_nickname(nickname):
             res = {'status': 'error', 'data': 'Invalid nickname!'}
-            return web.json_response(res)
+            return json_response(res)
 
         # check that the account for this nickname is present in the db,
         # if not, then create a new one
         db = request.config_dict['DB']
         account_id = await find_or_create_account(db, nickname)
 
-        # check that there is no active session with this nickname
-        if account_id in g_sessions:
+        # check that there is no active session with this nickname,
+        # and create session for this account
+        try:
+            created = g_sessions.try_create(account_id)
+        except SessionsBusy:
+            return g_admission.busy_response()
+        if not created:
             res = {'status': 'error', 'data': 'Session already exists!'}
-            return web.json_response(res)
-        else:
-            # create session for this account
-            g_sessions[account_id] = Session()
+            return json_response(res)
 
-        # add credits at every login
-        await add_credits_to_account(
+        # add credits at every login and get account info from the db
+        account_info = await add_credits_and_get_account_info(
             db, account_id, calc_credits_added_on_login())
 
-        # get account info from the db
-        account_info = await get_account_info(db, account_id)
-
         # create jwt with account_id as a payload
         token = get_token(account_id)
 
@@ -66,162 +150,171 @@ async def login_handle(request):
         import traceback
         traceback.print_exc()
         res = {'status': 'error', 'data': 'Error during login!'}
-    return web.json_response(res)
+    return json_response(res)
 
 
 async def logout_handle(request):
     try:
-        data = await request.json()
-        account_id = get_account_id_from_token(data['token'])
-        if account_id not in g_sessions:
-            res = {'status': 'error', 'data': 'Session not found!'}
-        else:
-            del g_sessions[account_id]
-            res = {'status': 'ok'}
+        g_sessions.remove(request['account_id'])
+        g_token_cache.pop(request['token'])
+        res = {'status': 'ok'}
+    except SessionsBusy:
+        return g_admission.busy_response()
     except:
         import traceback
         traceback.print_exc()
         res = {'status': 'error', 'data': 'Error during logout!'}
-    return web.json_response(res)
+    return json_response(res)
 
 
-async def get_account_info_handle(request):
-    try:
-        data = await request.json()
-        account_id = get_account_id_from_token(data['token'])
-        if account_id not in g_sessions:
-            res = {'status': 'error', 'data': 'Session not found!'}
-            return web.json_response(res)
+async def get_account_info_op(db, account_id, args):
+    # get account info from the db
+    account_info = await get_account_info(db, account_id)
+    return {'status': 'ok', 'data': account_info}
 
-        # get account info from the db
-        db = request.config_dict['DB']
-        account_info = await get_account_info(db, account_id)
 
-        res = {
-            'status': 'ok',
-            'data': account_info
-        }
-    except:
-        import traceback
-        traceback.print_exc()
-        res = {'status': 'error', 'data': 'Error during getting items!'}
-    return web.json_response(res)
+async def get_all_items_op(db, account_id, args):
+    return {'status': 'ok', 'data': g_all_items}
 
 
-async def get_all_items_handle(request):
-    try:
-        data = await request.json()
-        account_id = get_account_id_from_token(data['token'])
-        if account_id not in g_sessions:
-            res = {'status': 'error', 'data': 'Session not found!'}
-            return web.json_response(res)
+async def get_my_items_op(db, account_id, args):
+    # get items from bd
+    items = await get_my_items(db, account_id)
+    return {'status': 'ok', 'data': items}
 
-        res = {
-            'status': 'ok',
-            'data': g_all_items
-        }
-    except:
-        import traceback
-        traceback.print_exc()
-        res = {'status': 'error', 'data': 'Error during getting items!'}
-    return web.json_response(res)
 
+@serialized_per_account
+async def buy_item_op(db, account_id, args):
+    # unpack item id as str
+    item_id = str(args['id'])
 
-async def get_my_items_handle(request):
-    try:
-        data = await request.json()
-        account_id = get_account_id_from_token(data['token'])
-        if account_id not in g_sessions:
-            res = {'status': 'error', 'data': 'Session not found!'}
-            return web.json_response(res)
+    # first validation, check that user-input is allowed
+    if item_id not in g_all_items:
+        return {'status': 'error', 'data': 'Unknown item id to buy!'}
 
-        # get items from bd
-        db = request.config_dict['DB']
-        items = await get_my_items(db, account_id)
+    # get price of item
+    item_price = g_all_items[item_id]['price']
 
-        res = {
-            'status': 'ok',
-            'data': items
-        }
-    except:
-        import traceback
-        traceback.print_exc()
-        res = {'status': 'error', 'data': 'Error during getting items!'}
-    return web.json_response(res)
+    # try to buy an item (all extended validation there),
+    # on success the new account state comes back with it
+    ok, msg, state = await try_buy_item(
+        db, account_id, int(item_id), item_price, bool(args.get('items', False)))
+    res = {'status': 'ok' if ok else 'error', 'data': msg}
+    if ok:
+        res.update(state)
+    return res
 
 
-async def buy_item_handle(request):
-    try:
-        data = await request.json()
-        account_id = get_account_id_from_token(data['token'])
-        if account_id not in g_sessions:
-            res = {'status': 'error', 'data': 'Session not found!'}
-            return web.json_response(res)
+@serialized_per_account
+async def sell_item_op(db, account_id, args):
+    # unpack item id as str
+    item_id = str(args['id'])
 
-        # unpack item id as str
-        item_id = str(data['id'])
+    # first validation, check that user-input is allowed
+    if item_id not in g_all_items:
+        return {'status': 'error', 'data': 'Unknown item id to sell!'}
 
-        # first validation, check that user-input is allowed
-        if item_id not in g_all_items:
-            res = {'status': 'error', 'data': 'Unknown item id to buy!'}
-            return web.json_response(res)
+    # get price of item
+    item_price = g_all_items[item_id]['price']
 
-        # get price of item
-        item_price = g_all_items[item_id]['price']
+    # try to sell an item (all extended validation there),
+    # on success the new account state comes back with it
+    ok, msg, state = await try_sell_item(
+        db, account_id, int(item_id), item_price, bool(args.get('items', False)))
+    res = {'status': 'ok' if ok else 'error', 'data': msg}
+    if ok:
+        res.update(state)
+    return res
 
-        # convert to int
-        item_id = int(item_id)
 
-        # try to buy an item (all extended validation there)
-        db = request.config_dict['DB']
-        ok, msg = await try_buy_item(db, account_id, item_id, item_price)
+# operations of an authenticated account, served by their own routes
+# and by /batch: name -> (operation, message when it fails)
+operations = {
+    'get_account_info': (get_account_info_op, 'Error during getting items!'),
+    'get_all_items': (get_all_items_op, 'Error during getting items!'),
+    'get_my_items': (get_my_items_op, 'Error during getting items!'),
+    'buy_item': (buy_item_op, 'Error during getting items!'),
+    'sell_item': (sell_item_op, 'Error during getting items!'),
+}
 
-        res = {
-            'status': 'ok' if ok else 'error',
-            'data': msg
-        }
+
+async def run_operation(db, account_id, name, args):
+    op, error = operations[name]
+    try:
+        return await op(db, account_id, args)
     except:
         import traceback
         traceback.print_exc()
-        res = {'status': 'error', 'data': 'Error during getting items!'}
-    return web.json_response(res)
+        return {'status': 'error', 'data': error}
+
+
+def operation_handle(name):
+    ''' Route handler of one operation, args come in the json body '''
+    async def handle(request):
+        args = {}
+        if request.method == 'POST' and request.body_exists:
+            try:
+                args = await get_request_json(request)
+            except:
+                import traceback
+                traceback.print_exc()
+                res = {'status': 'error', 'data': operations[name][1]}
+                return json_response(res)
 
+        db = request.config_dict['DB']
+        res = await run_operation(db, request['account_id'], name, args)
+        return json_response(res)
+    return handle
 
-async def sell_item_handle(request):
-    try:
-        data = await request.json()
-        account_id = get_account_id_from_token(data['token'])
-        if account_id not in g_sessions:
-            res = {'status': 'error', 'data': 'Session not found!'}
-            return web.json_response(res)
-
-        # unpack item id as str
-        item_id = str(data['id'])
 
-        # first validation, check that user-input is allowed
-        if item_id not in g_all_items:
-            res = {'status': 'error', 'data': 'Unknown item id to sell!'}
-            return web.json_response(res)
+async def get_all_items_handle(request):
+    # the response is encoded only once, at startup
+    return g_all_items_response.response(request)
 
-        # get price of item
-        item_price = g_all_items[item_id]['price']
 
-        # convert to int
-        item_id = int(item_id)
+async def batch_handle(request):
+    ''' Run a list of operations in one round trip, in order.
 
-        # try to sell an item (all extended validation there)
-        db = request.config_dict['DB']
-        ok, msg = await try_sell_item(db, account_id, item_id, item_price)
-
-        res = {
-            'status': 'ok' if ok else 'error',
-            'data': msg
-        }
+    The body is {"ops": [{"op": name, "args": {...}}, ...], "stop_on_error": bool},
+    the response data has the result of every operation which ran '''
+    try:
+        data = await get_request_json(request)
+        ops = data['ops']
+        stop_on_error = bool(data.get('stop_on_error', False))
+        if not isinstance(ops, list) or not all(isinstance(op, dict) for op in ops):
+            raise ValueError('ops must be a list of objects')
     except:
         import traceback
         traceback.print_exc()
-        res = {'status': 'error', 'data': 'Error during getting items!'}
-    return web.json_response(res)
+        res = {'status': 'error', 'data': 'Invalid batch!'}
+        return json_response(res)
+
+    # every operation counts against the account's rate limit: the request
+    # itself took one token, the other operations take one each
+    rate_limited = g_admission.rate_per_second > 0
+    if len(ops) > g_config.batch_max_ops or (rate_limited and len(ops) > g_admission.burst):
+        res = {'status': 'error', 'data': 'Too many operations in the batch!'}
+        return json_response(res)
+
+    db = request.config_dict['DB']
+    account_id = request['account_id']
+    if rate_limited and len(ops) > 1:
+        wait = g_admission.take_token(account_id, len(ops) - 1)
+        if wait:
+            return g_admission.rate_limited_response(wait)
+    results = []
+    for op in ops:
+        name = op.get('op')
+        if name in operations:
+            result = await run_operation(db, account_id, name, op.get('args') or {})
+        else:
+            result = {'status': 'error', 'data': 'Unknown operation!'}
+        results.append(result)
+        if stop_on_error and result['status'] != 'ok':
+            break
+
+    res = {'status': 'ok', 'data': results}
+    return json_response(res)
 
 
 def calc_credits_added_on_login():
@@ -231,7 +324,12 @@ def calc_credits_added_on_login():
 
 def get_account_id_from_token(token):
     ''' When an invalid token is received, the exception will be raised! '''
-    return jwt.decode(token, g_secret_key)['account_id']
+    account_id = g_token_cache.get_account_id(token)
+    if account_id is None:
+        payload = jwt.decode(token, g_secret_key)
+        account_id = payload['account_id']
+        g_token_cache.put_token(token, payload)
+    return account_id
 
 
 def get_token(account_id):
@@ -239,27 +337,284 @@ def get_token(account_id):
         payload={'account_id': account_id}, key=g_secret_key).decode('utf-8')
 
 
+async def sweep_sessions(app):
+    if not g_sessions.sweeper:
+        yield
+        return
+    task = asyncio.ensure_future(
+        g_sessions.sweep_forever(g_config.session_sweep_interval))
+    yield
+    task.cancel()
+
+
+async def monitor_loop(app):
+    monitor = LoopMonitor(
+        stall_threshold=g_config.loop_stall_threshold,
+        log_interval=g_config.loop_stall_log_interval,
+        on_lag=g_metrics.observe_loop_lag)
+    app['MONITOR'] = monitor
+    task = asyncio.ensure_future(monitor.run())
+    yield
+    task.cancel()
+
+
+def register_metrics(app):
+    g_metrics.collect(
+        'sessions', 'gauge', 'Live sessions.', lambda: len(g_sessions))
+    g_metrics.collect(
+        'sessions_expired_total', 'counter', 'Sessions removed by the sweeper.',
+        lambda: g_sessions.expired)
+    g_metrics.collect(
+        'inflight_requests', 'gauge', 'Requests being handled.',
+        lambda: g_admission.inflight)
+    g_metrics.collect(
+        'shed_requests_total', 'counter', 'Requests refused by admission control.',
+        lambda: {
+            'inflight': g_admission.shed_inflight,
+            'route': g_admission.shed_route,
+            'rate_limit': g_admission.rate_limited
+        }, label='reason')
+    g_metrics.collect(
+        'aiosqlite_queue_depth', 'gauge', 'Calls waiting for the db threads.',
+        lambda: app['DB'].queue_depth(), label='connection')
+    g_metrics.collect(
+        'loop_stalls_total', 'counter', 'Times the event loop was blocked over the stall threshold.',
+        lambda: app['MONITOR'].stalls)
+    if g_access_log is not None:
+        g_metrics.collect(
+            'access_log_dropped_total', 'counter', 'Access log lines dropped on a full buffer.',
+            lambda: g_access_log.dropped)
+        g_metrics.collect(
+            'access_log_failed_total', 'counter', 'Access log lines which failed to format or emit.',
+            lambda: g_access_log.failed)
+    if g_config.db_stats:
+        register_db_stats_metrics(app)
+    register_cache_metrics(app)
+    register_lock_metrics()
+
+
+def register_lock_metrics():
+    g_metrics.collect(
+        'account_lock_acquired_total', 'counter', 'Per-account locks taken.',
+        lambda: g_account_locks.acquired)
+    g_metrics.collect(
+        'account_lock_contended_total', 'counter', 'Per-account locks which had to wait.',
+        lambda: g_account_locks.contended)
+    g_metrics.collect(
+        'account_lock_wait_seconds_total', 'counter', 'Time spent waiting for per-account locks.',
+        lambda: g_account_locks.wait_time)
+    g_metrics.collect(
+        'account_lock_max_wait_seconds', 'gauge', 'Longest wait for a per-account lock.',
+        lambda: g_account_locks.max_wait)
+
+
+def register_cache_metrics(app):
+    def caches():
+        return {
+            'accounts': app['DB'].accounts,
+            'account_ids': app['DB'].account_ids,
+            'tokens': g_token_cache
+        }
+
+    def by_cache(key):
+        return lambda: {name: cache.stats()[key] for name, cache in caches().items()}
+
+    g_metrics.collect(
+        'cache_entries', 'gauge', 'Entries in each cache.',
+        by_cache('size'), label='cache')
+    g_metrics.collect(
+        'cache_hits_total', 'counter', 'Lookups found in each cache.',
+        by_cache('hits'), label='cache')
+    g_metrics.collect(
+        'cache_misses_total', 'counter', 'Lookups missed by each cache.',
+        by_cache('misses'), label='cache')
+    g_metrics.collect(
+        'cache_hit_ratio', 'gauge', 'Hits of all the lookups of each cache so far.',
+        by_cache('hit_rate'), label='cache')
+
+
+def register_db_stats_metrics(app):
+    def by_sql(column):
+        return lambda: {
+            ' '.join(row['sql'].split()): row[column]
+            for row in app['DB'].query_stats().rows()
+        }
+
+    g_metrics.collect(
+        'db_statement_calls_total', 'counter', 'Executions of each SQL statement.',
+        by_sql('calls'), label='sql')
+    g_metrics.collect(
+        'db_statement_seconds_total', 'counter', 'Time spent executing each SQL statement.',
+        by_sql('total_time'), label='sql')
+    g_metrics.collect(
+        'db_statement_rows_total', 'counter', 'Rows returned by each SQL statement.',
+        by_sql('rows'), label='sql')
+
+
+async def create_account_locks(app):
+    # asyncio locks of python < 3.10 create the event loop when there is none,
+    # a loop created before fork() would be shared by all the workers
+    global g_account_locks
+    g_account_locks = StripedLock(g_config.account_lock_stripes)
+    yield
+
+
+async def write_access_log(app):
+    # the thread starts in the process which serves the requests
+    g_access_log.start()
+    yield
+    g_access_log.close()
+
+
+async def enable_timing(app):
+    app['DB'].set_timing_hook(record_db_call)
+    yield
+
+
 async def init_app():
-    app = web.Application()
+    middlewares = [
+        g_metrics.middleware,
+        g_admission.inflight_middleware,
+        auth_middleware,
+        g_admission.rate_limit_middleware
+    ]
+    if g_config.server_timing:
+        timing = Timing(g_config.slow_request_threshold, g_config.slow_request_sample_rate)
+        middlewares.insert(1, timing.middleware)
+        g_metrics.collect(
+            'slow_requests_total', 'counter', 'Requests over the slow threshold.',
+            lambda: timing.slow_requests)
+
+    app = web.Application(middlewares=middlewares)
     app.add_routes([
         web.post("/login", login_handle),
-        web.post("/get_account_info", get_account_info_handle),
+        web.get("/get_account_info", operation_handle('get_account_info')),
+        web.post("/get_account_info", operation_handle('get_account_info')),
+        web.get("/get_all_items", get_all_items_handle),
         web.post("/get_all_items", get_all_items_handle),
-        web.post("/get_my_items", get_my_items_handle),
-        web.post("/buy_item", buy_item_handle),
-        web.post("/sell_item", sell_item_handle),
-        web.post("/logout", logout_handle)
+        web.get("/get_my_items", operation_handle('get_my_items')),
+        web.post("/get_my_items", operation_handle('get_my_items')),
+        web.post("/buy_item", operation_handle('buy_item')),
+        web.post("/sell_item", operation_handle('sell_item')),
+        web.post("/batch", batch_handle),
+        web.post("/logout", logout_handle),
+        web.get("/metrics", g_metrics.handle)
     ])
+    if g_config.admin_token:
+        debug = Debug(g_config.admin_token, g_config.profile_max_seconds)
+        app.add_routes(debug.routes())
+    app['CONFIG'] = g_config
+    app.cleanup_ctx.append(create_account_locks)
     app.cleanup_ctx.append(init_db)
+    app.cleanup_ctx.append(sweep_sessions)
+    app.cleanup_ctx.append(monitor_loop)
+    if g_config.server_timing:
+        app.cleanup_ctx.append(enable_timing)
+    if g_access_log is not None:
+        app.cleanup_ctx.append(write_access_log)
+    register_metrics(app)
     return app
 
 
-if __name__ == '__main__':
-    # load server configuration
-    g_config = ServerConfig()
-
-    # init storage for sessions (of course, dict is not perfect)
-    g_sessions = {}
+def run_app(**kwargs):
+    if g_access_log is not None:
+        kwargs['access_log_class'] = g_access_log.logger_class()
+    web.run_app(init_app(), host=g_config.host, port=g_config.port,
+                access_log_format=g_config.access_log_format, **kwargs)
+
+
+def run_worker(index):
+    global g_sessions
+    # every process has its own connection to the shared sessions,
+    # the first one removes the expired sessions of all of them
+    g_sessions = SharedSessionStore(
+        sessions_db, g_config.session_idle_ttl, g_config.session_absolute_ttl,
+        busy_timeout=g_config.session_busy_timeout, sweeper=index == 0)
+    # metrics, admission counters and caches are the worker's own, and
+    # a scrape of /metrics is answered by whichever worker accepts it
+    g_metrics.collect(
+        'worker', 'gauge', 'Index of the worker process which answered the scrape.',
+        lambda: {os.getpid(): index}, label='pid')
+    run_app(reuse_port=True)
+
+
+def run_workers(count, shutdown_timeout):
+    ''' Fork processes which accept connections on the same port,
+    the kernel spreads the connections between them.
+
+    Ctrl-C reaches every process of the group, a SIGTERM of this process
+    is passed on to the workers. Workers still running shutdown_timeout
+    seconds later, or at a second signal, are terminated and then killed '''
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=run_worker, args=(index,)) for index in range(count)]
+    for worker in workers:
+        worker.start()
+
+    # the handler only takes note, the loops below wake up to look
+    received = []
+
+    def on_signal(signum, frame):
+        received.append(signum)
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    def wait_workers(until):
+        while not until():
+            alive = [worker.sentinel for worker in workers if worker.is_alive()]
+            if not alive:
+                return
+            multiprocessing.connection.wait(alive, timeout=0.2)
+
+    # serve until a signal, or until every worker is gone
+    wait_workers(lambda: received)
+    if signal.SIGTERM in received:
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGTERM)
+
+    deadline = time.monotonic() + shutdown_timeout
+    wait_workers(lambda: len(received) > 1 or time.monotonic() > deadline)
+    for index, worker in enumerate(workers):
+        if worker.is_alive():
+            LOG.warning('worker %d (pid %d) did not exit, terminating it', index, worker.pid)
+            worker.terminate()
+    for index, worker in enumerate(workers):
+        worker.join(1.0)
+        if worker.is_alive():
+            LOG.warning('worker %d (pid %d) did not terminate, killing it', index, worker.pid)
+            worker.kill()
+            worker.join()
+
+
+def init_globals(config):
+    ''' Set up the state the handlers share, before init_app() '''
+    global g_config, g_token_cache, g_account_locks, g_admission, g_metrics
+    global g_access_log, g_secret_key, g_all_items, g_all_items_response, g_sessions
+
+    g_config = config
+
+    # verified tokens, so that jwt is decoded once per token
+    g_token_cache = TokenCache(g_config.token_cache_size)
+
+    # mutating requests of one account are serialized, the locks are
+    # created at startup, in the process which serves the requests
+    g_account_locks = None
+
+    # in-flight limits and per-account rate limit
+    g_admission = AdmissionControl(
+        g_config.max_inflight, g_config.route_inflight_limits,
+        g_config.rate_limit_per_second, g_config.rate_limit_burst,
+        g_config.retry_after)
+
+    # request counters and latency histograms served on /metrics
+    g_metrics = Metrics()
+
+    # access log lines are formatted and written off the event loop
+    g_access_log = None
+    if g_config.access_log_async:
+        g_access_log = AccessLogWriter(
+            access_logger, g_config.access_log_sample_rate, g_config.access_log_buffer,
+            log_format=g_config.access_log_format)
 
     # create key used for jwt
     g_secret_key = 'secret' # use this for better security: secrets.token_urlsafe(12)
@@ -267,9 +622,27 @@ if __name__ == '__main__':
     # load items from a file
     with Path('data/all_items.json').open('r', encoding='utf-8') as f:
         g_all_items = json.load(f)
+    g_all_items_response = EncodedJson({'status': 'ok', 'data': g_all_items})
+
+    # init storage for sessions, they expire when idle or too old;
+    # workers replace it with the store they share
+    g_sessions = SessionStore(
+        g_config.session_idle_ttl, g_config.session_absolute_ttl)
+
+
+if __name__ == '__main__':
+    # the server's own logs and the access log go to stderr
+    logging.basicConfig(level=logging.INFO)
+
+    # load server configuration
+    init_globals(ServerConfig())
 
-    # create and fill database, if it didn't exist
-    try_make_db()
+    # create database, if it didn't exist, and apply pending migrations
+    migrate_db()
 
-    # run server
-    web.run_app(init_app(), host=g_config.host, port=g_config.port)
+    # run server, in several processes if there is fork()
+    if g_config.workers > 1 and hasattr(os, 'fork'):
+        SharedSessionStore.reset(sessions_db)
+        run_workers(g_config.workers, g_config.worker_shutdown_timeout)
+    else:
+        run_app()
@@ -0,0 +1,143 @@
+import time
+from bisect import bisect_left
+from aiohttp import hdrs, web
+
+
+# upper bounds in seconds, the last bucket (+Inf) is implicit
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    ''' Fixed buckets, so observing is a bisect and two additions; the
+    counts are made cumulative only when rendered '''
+
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def render(self, name, labels=''):
+        sep = ',' if labels else ''
+        total = 0
+        for bound, count in zip(self.bounds, self.counts):
+            total += count
+            yield f'{name}_bucket{{{labels}{sep}le="{bound}"}} {total}'
+        total += self.counts[-1]
+        yield f'{name}_bucket{{{labels}{sep}le="+Inf"}} {total}'
+        suffix = f'{{{labels}}}' if labels else ''
+        yield f'{name}_sum{suffix} {self.sum}'
+        yield f'{name}_count{suffix} {total}'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    ''' Request counters and latency histograms per route, plus values
+    collected from the rest of the server when scraped. Everything is
+    updated from the event loop thread only, so nothing is locked '''
+
+    def __init__(self, prefix='server', buckets=LATENCY_BUCKETS):
+        self.prefix = prefix
+        self.buckets = tuple(buckets)
+        # (route, method, status) -> count
+        self.requests = {}
+        # route -> Histogram
+        self.latency = {}
+        self.loop_lag = Histogram(LOOP_LAG_BUCKETS)
+        self.last_loop_lag = 0.0
+        # name -> (type, help, fn, label)
+        self.collectors = {}
+
+    def collect(self, name, kind, help, fn, label=None):
+        ''' fn() is called on every scrape and returns a number, or a dict
+        of numbers by the value of label '''
+        self.collectors[name] = (kind, help, fn, label)
+
+    def observe_request(self, route, method, status, duration):
+        key = (route, method, status)
+        self.requests[key] = self.requests.get(key, 0) + 1
+        histogram = self.latency.get(route)
+        if histogram is None:
+            histogram = self.latency[route] = Histogram(self.buckets)
+        histogram.observe(duration)
+
+    @property
+    def middleware(self):
+        @web.middleware
+        async def metrics_middleware(request, handler):
+            # label by route, not by path, to keep the number of series bounded
+            resource = request.match_info.route.resource
+            route = resource.canonical if resource is not None else 'unmatched'
+            status = 500
+            before = time.perf_counter()
+            try:
+                response = await handler(request)
+                status = response.status
+                return response
+            except web.HTTPException as e:
+                status = e.status
+                raise
+            finally:
+                self.observe_request(
+                    route, request.method, status, time.perf_counter() - before)
+
+        return metrics_middleware
+
+    def observe_loop_lag(self, lag):
+        self.last_loop_lag = lag
+        self.loop_lag.observe(lag)
+
+    def render(self):
+        p = self.prefix
+        lines = [
+            f'# HELP {p}_requests_total Handled requests.',
+            f'# TYPE {p}_requests_total counter',
+        ]
+        for (route, method, status), count in sorted(self.requests.items()):
+            lines.append(
+                f'{p}_requests_total{{route="{escape_label(route)}",'
+                f'method="{method}",status="{status}"}} {count}')
+
+        lines.append(f'# HELP {p}_request_duration_seconds Request latency.')
+        lines.append(f'# TYPE {p}_request_duration_seconds histogram')
+        for route, histogram in sorted(self.latency.items()):
+            lines.extend(histogram.render(
+                f'{p}_request_duration_seconds', f'route="{escape_label(route)}"'))
+
+        lines.append(f'# HELP {p}_loop_lag_seconds Event loop lag.')
+        lines.append(f'# TYPE {p}_loop_lag_seconds histogram')
+        lines.extend(self.loop_lag.render(f'{p}_loop_lag_seconds'))
+        lines.append(f'# HELP {p}_loop_lag_last_seconds Last measured event loop lag.')
+        lines.append(f'# TYPE {p}_loop_lag_last_seconds gauge')
+        lines.append(f'{p}_loop_lag_last_seconds {self.last_loop_lag}')
+
+        for name, (kind, help, fn, label) in sorted(self.collectors.items()):
+            lines.append(f'# HELP {p}_{name} {help}')
+            lines.append(f'# TYPE {p}_{name} {kind}')
+            value = fn()
+            if label is None:
+                lines.append(f'{p}_{name} {value}')
+            else:
+                for key, v in sorted(value.items()):
+                    lines.append(f'{p}_{name}{{{label}="{escape_label(key)}"}} {v}')
+
+        lines.append('')
+        return '\n'.join(lines)
+
+    async def handle(self, request):
+        return web.Response(
+            body=self.render().encode('utf-8'), headers={hdrs.CONTENT_TYPE: CONTENT_TYPE})
@@ -0,0 +1,66 @@
+import sqlite3
+
+
+# ordered schema migrations, the schema version of a database is the
+# number of migrations applied to it (kept in PRAGMA user_version)
+MIGRATIONS = [
+    # 1: initial schema
+    '''
+    CREATE TABLE IF NOT EXISTS Accounts (
+    nickname TEXT NOT NULL,
+    credits INTEGER DEFAULT 0);
+
+    CREATE TABLE IF NOT EXISTS Items (
+    account_id INTEGER NOT NULL,
+    item_id INTEGER NOT NULL);
+    ''',
+
+    # 2: nickname lookups are case-insensitive, index them the same way;
+    # accounts created twice by a login race are merged into the oldest
+    # one first: it gets their credits and items
+    '''
+    UPDATE Accounts SET credits = credits + (
+    SELECT COALESCE(SUM(dup.credits), 0) FROM Accounts dup
+    WHERE dup.nickname = Accounts.nickname COLLATE NOCASE AND dup.rowid > Accounts.rowid)
+    WHERE rowid IN (SELECT MIN(rowid) FROM Accounts GROUP BY nickname COLLATE NOCASE);
+
+    UPDATE Items SET account_id = (
+    SELECT MIN(kept.rowid) FROM Accounts kept, Accounts dup
+    WHERE dup.rowid = Items.account_id AND kept.nickname = dup.nickname COLLATE NOCASE)
+    WHERE account_id IN (SELECT rowid FROM Accounts) AND account_id NOT IN (
+    SELECT MIN(rowid) FROM Accounts GROUP BY nickname COLLATE NOCASE);
+
+    DELETE FROM Accounts WHERE rowid NOT IN (
+    SELECT MIN(rowid) FROM Accounts GROUP BY nickname COLLATE NOCASE);
+
+    CREATE UNIQUE INDEX IF NOT EXISTS AccountsNickname
+    ON Accounts (nickname COLLATE NOCASE);
+    ''',
+
+    # 3: an account owns an item at most once, drop duplicates if any
+    '''
+    DELETE FROM Items WHERE rowid NOT IN (
+    SELECT MIN(rowid) FROM Items GROUP BY account_id, item_id);
+
+    CREATE UNIQUE INDEX IF NOT EXISTS ItemsAccountItem
+    ON Items (account_id, item_id);
+    ''',
+]
+
+
+def get_schema_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, target=None):
+    ''' Apply pending migrations up to the target version (all by default),
+    each one in its own transaction '''
+    version = get_schema_version(conn)
+    for version, script in enumerate(MIGRATIONS[version:target], start=version + 1):
+        try:
+            conn.executescript(
+                f'BEGIN; {script}; PRAGMA user_version = {version}; COMMIT;')
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+    return version
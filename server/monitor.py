@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+
+LOG = logging.getLogger('server.monitor')
+
+
+class LoopMonitor:
+    ''' Measures how late the event loop runs a sleeping task, and keeps a
+    watchdog thread which logs the stack of the loop thread when the loop
+    doesn't come back for longer than the stall threshold '''
+
+    def __init__(self, interval=0.1, stall_threshold=0.1, log_interval=10.0, on_lag=None):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.log_interval = log_interval
+        self.on_lag = on_lag
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.stalls_logged = 0
+        self._heartbeat = time.monotonic()
+        self._loop_thread = None
+        self._stopped = threading.Event()
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        if self.stall_threshold > 0:
+            self._stopped.clear()
+            watchdog = threading.Thread(target=self.watch, name='loop-watchdog', daemon=True)
+            watchdog.start()
+        try:
+            while True:
+                before = loop.time()
+                await asyncio.sleep(self.interval)
+                self._heartbeat = time.monotonic()
+                self.last_lag = max(0.0, loop.time() - before - self.interval)
+                self.max_lag = max(self.max_lag, self.last_lag)
+                if self.on_lag is not None:
+                    self.on_lag(self.last_lag)
+        finally:
+            # the daemon thread exits on its next wakeup, joining it here
+            # would block the loop on shutdown
+            self._stopped.set()
+
+    def watch(self):
+        ''' Watchdog thread: one report per stall, at most one log line
+        per log interval '''
+        reported = None
+        last_log = float('-inf')
+        while not self._stopped.wait(self.stall_threshold / 2):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled < self.stall_threshold or heartbeat == reported:
+                continue
+            reported = heartbeat
+            self.stalls += 1
+
+            now = time.monotonic()
+            if now - last_log < self.log_interval:
+                continue
+            last_log = now
+            self.stalls_logged += 1
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+            LOG.warning('event loop blocked for %.0fms (%d stalls, %d logged), loop thread is at:\n%s',
+                        stalled * 1e3, self.stalls, self.stalls_logged, stack)
+
+    def stats(self):
+        return {
+            'last_lag': self.last_lag,
+            'max_lag': self.max_lag,
+            'stalls': self.stalls,
+            'stalls_logged': self.stalls_logged
+        }
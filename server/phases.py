@@ -0,0 +1,46 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+
+# phases of the request being handled, None when timing is off;
+# no web imports here, the storage layer times its phases too
+current = contextvars.ContextVar('request_timing', default=None)
+
+
+class RequestTiming:
+    ''' Seconds spent in each phase of one request '''
+
+    __slots__ = ('phases',)
+
+    def __init__(self):
+        self.phases = {}
+
+    def add(self, name, duration):
+        self.phases[name] = self.phases.get(name, 0.0) + duration
+
+    def header(self, total):
+        metrics = [f'{name};dur={duration * 1e3:.3f}' for name, duration in self.phases.items()]
+        metrics.append(f'total;dur={total * 1e3:.3f}')
+        return ', '.join(metrics)
+
+
+@contextmanager
+def phase(name):
+    timing = current.get()
+    if timing is None:
+        yield
+        return
+    before = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, time.perf_counter() - before)
+
+
+def record_db_call(queue_wait, duration):
+    ''' Timing hook of the aiosqlite connections '''
+    timing = current.get()
+    if timing is not None:
+        timing.add('db_queue', queue_wait)
+        timing.add('sql', duration)
@@ -1,10 +1,246 @@
-from dataclasses import dataclass
-from datetime import datetime
+import asyncio
+import functools
+import heapq
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+
+
+sessions_db = Path('sessions.sqlite3')
 
 
-@dataclass(init=False)
 class Session:
-    time: datetime
+    # a few floats per session, there may be a lot of them
+    __slots__ = ('created', 'last_seen', 'sweep_at')
+
+    def __init__(self, now):
+        self.created = now
+        self.last_seen = now
+        self.sweep_at = now
+
+
+class SessionStore:
+    ''' Sessions by account_id. A session expires after idle_ttl seconds
+    without requests, or absolute_ttl seconds after login, whatever is first.
+
+    Each session has a single entry in a heap ordered by the time it may
+    expire; a sweep only pops the due entries and puts back those which
+    were refreshed meanwhile, so neither touch() nor sweep() ever scan
+    the whole store '''
+
+    def __init__(self, idle_ttl, absolute_ttl, clock=time.monotonic):
+        self.idle_ttl = idle_ttl
+        self.absolute_ttl = absolute_ttl
+        self.clock = clock
+        self.expired = 0
+        self._sessions = {}
+        self._heap = []
+        # every process sweeps its own sessions
+        self.sweeper = True
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, account_id):
+        session = self._sessions.get(account_id)
+        return session is not None and not self._is_expired(session, self.clock())
+
+    def _deadline(self, session):
+        return min(session.last_seen + self.idle_ttl, session.created + self.absolute_ttl)
+
+    def _is_expired(self, session, now):
+        return self._deadline(session) <= now
+
+    def _schedule(self, account_id, session):
+        session.sweep_at = self._deadline(session)
+        heapq.heappush(self._heap, (session.sweep_at, account_id))
+
+    def create(self, account_id):
+        session = Session(self.clock())
+        self._sessions[account_id] = session
+        self._schedule(account_id, session)
+        return session
+
+    def try_create(self, account_id):
+        ''' Create a session unless the account already has a live one '''
+        if account_id in self:
+            return False
+        self.create(account_id)
+        return True
+
+    def touch(self, account_id):
+        ''' Refresh the session of the account, False if there is none '''
+        session = self._sessions.get(account_id)
+        if session is None:
+            return False
+        now = self.clock()
+        if self._is_expired(session, now):
+            return False
+        session.last_seen = now
+        return True
+
+    def remove(self, account_id):
+        # the heap entry of the session is dropped by the next sweep
+        return self._sessions.pop(account_id, None) is not None
+
+    def is_sweep_due(self):
+        return bool(self._heap) and self._heap[0][0] <= self.clock()
+
+    def sweep(self, limit=None):
+        ''' Remove expired sessions, looking at no more than limit heap
+        entries, and return how many sessions were removed '''
+        now = self.clock()
+        heap = self._heap
+        removed = 0
+        popped = 0
+        while heap and heap[0][0] <= now:
+            if limit is not None and popped >= limit:
+                break
+            popped += 1
+            sweep_at, account_id = heapq.heappop(heap)
+            session = self._sessions.get(account_id)
+            if session is None or session.sweep_at != sweep_at:
+                # removed or replaced, the entry is stale
+                continue
+            if self._is_expired(session, now):
+                del self._sessions[account_id]
+                removed += 1
+            else:
+                self._schedule(account_id, session)
+        self.expired += removed
+        return removed
+
+    async def sweep_forever(self, interval, chunk=10_000):
+        while True:
+            await asyncio.sleep(interval)
+            # a large backlog (e.g. after a login storm) is swept in chunks,
+            # so that requests are served in between
+            self.sweep(chunk)
+            while self.is_sweep_due():
+                await asyncio.sleep(0)
+                self.sweep(chunk)
+
+
+class SessionsBusy(Exception):
+    ''' The shared sessions were locked by another process for longer
+    than the busy timeout, the request may be retried '''
+
+
+def raises_sessions_busy(method):
+    ''' The method raises SessionsBusy when the database stayed locked,
+    nothing is retried here: the client is told to retry instead '''
+    @functools.wraps(method)
+    def wrapper(self, *args):
+        try:
+            return method(self, *args)
+        except sqlite3.OperationalError as e:
+            if 'locked' in str(e) or 'busy' in str(e):
+                raise SessionsBusy() from e
+            raise
+    return wrapper
+
+
+class SharedSessionStore(SessionStore):
+    ''' SessionStore kept in a SQLite table, so that several server
+    processes share the sessions. Calls are short and run right on the
+    event loop, so they wait for a lock held by another process no longer
+    than busy_timeout seconds and raise SessionsBusy instead of stalling
+    the loop; last_seen is written at most once per touch_interval seconds
+    per session, other touches only read. Only the process created with
+    sweeper=True removes expired sessions '''
+
+    def __init__(self, path, idle_ttl, absolute_ttl, touch_interval=1.0,
+                 busy_timeout=0.05, sweeper=True, clock=time.monotonic):
+        super().__init__(idle_ttl, absolute_ttl, clock)
+        self.touch_interval = touch_interval
+        self.sweeper = sweeper
+        # sessions don't survive a restart, no need to wait for the disk
+        self.conn = sqlite3.connect(str(path), timeout=busy_timeout, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL').fetchall()
+        self.conn.execute('PRAGMA synchronous=OFF')
+
+    @staticmethod
+    def reset(path):
+        ''' Start with no sessions, called once before the processes start '''
+        with closing(sqlite3.connect(str(path))) as conn:
+            conn.executescript(
+                '''
+                DROP TABLE IF EXISTS Sessions;
+                CREATE TABLE Sessions (
+                account_id INTEGER PRIMARY KEY,
+                created REAL NOT NULL,
+                last_seen REAL NOT NULL,
+                expires_at REAL NOT NULL);
+                CREATE INDEX SessionsExpiresAt ON Sessions (expires_at);
+                '''
+            )
+
+    @raises_sessions_busy
+    def __len__(self):
+        return self.conn.execute(
+            'SELECT count(*) FROM Sessions WHERE expires_at > ?', [self.clock()]).fetchone()[0]
+
+    @raises_sessions_busy
+    def __contains__(self, account_id):
+        return bool(self.conn.execute(
+            'SELECT 1 FROM Sessions WHERE account_id = ? AND expires_at > ?',
+            [account_id, self.clock()]).fetchall())
+
+    def create(self, account_id):
+        self.try_create(account_id)
+
+    @raises_sessions_busy
+    def try_create(self, account_id):
+        # check and insert in one statement, another process may log in too;
+        # an expired session which is not swept yet is replaced
+        now = self.clock()
+        cursor = self.conn.execute(
+            '''INSERT INTO Sessions (account_id, created, last_seen, expires_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (account_id) DO UPDATE SET
+            created = excluded.created,
+            last_seen = excluded.last_seen,
+            expires_at = excluded.expires_at
+            WHERE expires_at <= ?''',
+            [account_id, now, now, now + min(self.idle_ttl, self.absolute_ttl), now])
+        return cursor.rowcount == 1
+
+    @raises_sessions_busy
+    def touch(self, account_id):
+        now = self.clock()
+        rows = self.conn.execute(
+            'SELECT created, last_seen FROM Sessions WHERE account_id = ? AND expires_at > ?',
+            [account_id, now]).fetchall()
+        if not rows:
+            return False
+        ((created, last_seen),) = rows
+        if now - last_seen >= self.touch_interval:
+            self.conn.execute(
+                'UPDATE Sessions SET last_seen = ?, expires_at = ? WHERE account_id = ? AND created = ?',
+                [now, min(now + self.idle_ttl, created + self.absolute_ttl), account_id, created])
+        return True
+
+    @raises_sessions_busy
+    def remove(self, account_id):
+        return self.conn.execute(
+            'DELETE FROM Sessions WHERE account_id = ?', [account_id]).rowcount > 0
+
+    def is_sweep_due(self):
+        try:
+            return bool(self.conn.execute(
+                'SELECT 1 FROM Sessions WHERE expires_at <= ? LIMIT 1', [self.clock()]).fetchall())
+        except sqlite3.OperationalError:
+            # busy, the next sweep will do
+            return False
 
-    def __init__(self):
-        self.time = datetime.utcnow()
+    def sweep(self, limit=None):
+        try:
+            removed = self.conn.execute(
+                '''DELETE FROM Sessions WHERE account_id IN (
+                SELECT account_id FROM Sessions WHERE expires_at <= ? LIMIT ?)''',
+                [self.clock(), -1 if limit is None else limit]).rowcount
+        except sqlite3.OperationalError:
+            return 0
+        self.expired += removed
+        return removed
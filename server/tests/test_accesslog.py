@@ -0,0 +1,36 @@
+import logging
+import time
+import unittest
+from types import SimpleNamespace
+
+from aiohttp import HttpVersion11
+
+from accesslog import AccessLogWriter
+
+
+class AccessLogWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.logger = logging.getLogger('tests.access')
+        self.writer = AccessLogWriter(self.logger, log_format='%a "%r" %s %b')
+        self.request = SimpleNamespace(
+            remote='127.0.0.1', method='GET', path_qs='/get_all_items',
+            version=HttpVersion11, headers={})
+        self.response = SimpleNamespace(status=200, body_length=5, headers={})
+
+    def test_one_record_per_request(self):
+        with self.assertLogs(self.logger, 'INFO') as logs:
+            self.writer.write(time.time(), self.request, self.response, 0.01)
+        self.assertEqual(logs.records[0].getMessage(), '127.0.0.1 "GET /get_all_items HTTP/1.1" 200 5')
+        self.assertEqual(logs.records[0].response_status, 200)
+        self.assertEqual((self.writer.written, self.writer.failed), (1, 0))
+
+    def test_failures_are_not_written(self):
+        del self.request.version
+        with self.assertLogs(self.logger, 'INFO') as logs:
+            self.writer.write(time.time(), self.request, self.response, 0.01)
+        self.assertEqual([record.levelname for record in logs.records], ['ERROR'])
+        self.assertEqual((self.writer.written, self.writer.failed), (0, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import unittest
+from unittest import mock
+
+import aiounittest
+from aiohttp import hdrs, web
+from aiohttp.test_utils import make_mocked_request
+
+from admission import AdmissionControl
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch('admission.time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 2 requests per second, 4 at once
+        self.admission = AdmissionControl(rate_per_second=2.0, burst=4, retry_after=3)
+
+    def test_burst_then_rate(self):
+        for _ in range(4):
+            self.assertEqual(self.admission.take_token(1), 0)
+        self.assertEqual(self.admission.take_token(1), 0.5)
+        # other accounts have buckets of their own
+        self.assertEqual(self.admission.take_token(2), 0)
+        self.now += 0.5
+        self.assertEqual(self.admission.take_token(1), 0)
+        self.assertEqual(self.admission.take_token(1), 0.5)
+
+    def test_refill_up_to_burst(self):
+        for _ in range(4):
+            self.admission.take_token(1)
+        self.now += 60
+        for _ in range(4):
+            self.assertEqual(self.admission.take_token(1), 0)
+        self.assertGreater(self.admission.take_token(1), 0)
+
+    def test_several_tokens(self):
+        self.assertEqual(self.admission.take_token(1, 3), 0)
+        # one token left, three are missing for four
+        self.assertEqual(self.admission.take_token(1, 4), 1.5)
+        # a refused request takes nothing
+        self.assertEqual(self.admission.take_token(1, 1), 0)
+
+    def test_rate_limited_response(self):
+        response = self.admission.rate_limited_response(1.2)
+        self.assertEqual(response.status, 429)
+        self.assertEqual(response.headers[hdrs.RETRY_AFTER], '2')
+        self.assertEqual(self.admission.rate_limited, 1)
+
+    def test_busy_response(self):
+        response = self.admission.busy_response()
+        self.assertEqual(response.status, 503)
+        self.assertEqual(response.headers[hdrs.RETRY_AFTER], '3')
+
+
+class MiddlewareTest(aiounittest.AsyncTestCase):
+    async def ok(self, request):
+        return web.json_response({'status': 'ok'})
+
+    async def test_inflight_limits(self):
+        admission = AdmissionControl(max_inflight=2, route_limits={'/slow': 1})
+        middleware = admission.inflight_middleware
+        release = asyncio.Event()
+
+        async def slow(request):
+            await release.wait()
+            return await self.ok(request)
+
+        first = asyncio.ensure_future(middleware(make_mocked_request('GET', '/slow'), slow))
+        await asyncio.sleep(0)
+        # over the route's limit
+        response = await middleware(make_mocked_request('GET', '/slow'), slow)
+        self.assertEqual(response.status, 503)
+        self.assertEqual(admission.shed_route, 1)
+
+        second = asyncio.ensure_future(middleware(make_mocked_request('GET', '/other'), slow))
+        await asyncio.sleep(0)
+        # over the server's limit
+        response = await middleware(make_mocked_request('GET', '/fast'), self.ok)
+        self.assertEqual(response.status, 503)
+        self.assertEqual(admission.shed_inflight, 1)
+        self.assertEqual(admission.inflight, 2)
+
+        release.set()
+        self.assertEqual((await first).status, 200)
+        self.assertEqual((await second).status, 200)
+        self.assertEqual(admission.inflight, 0)
+        self.assertEqual(admission.route_inflight, {'/slow': 0})
+        response = await middleware(make_mocked_request('GET', '/fast'), self.ok)
+        self.assertEqual(response.status, 200)
+
+    async def test_rate_limit(self):
+        admission = AdmissionControl(rate_per_second=1.0, burst=1, retry_after=1)
+        middleware = admission.rate_limit_middleware
+
+        request = make_mocked_request('GET', '/get_my_items')
+        request['account_id'] = 1
+        self.assertEqual((await middleware(request, self.ok)).status, 200)
+        response = await middleware(request, self.ok)
+        self.assertEqual(response.status, 429)
+        self.assertEqual(json.loads(response.body)['data'], 'Too many requests!')
+        self.assertEqual(response.headers[hdrs.RETRY_AFTER], '1')
+
+        # requests before authentication aren't limited
+        request = make_mocked_request('POST', '/login')
+        self.assertEqual((await middleware(request, self.ok)).status, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
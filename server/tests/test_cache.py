@@ -0,0 +1,84 @@
+import time
+import unittest
+
+from cache import AccountCache, TokenCache
+
+
+class AccountCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = AccountCache(10)
+
+    def test_fill(self):
+        info = {'nickname': 'bob', 'credits': 100}
+        ticket = self.cache.begin_fill(1)
+        self.cache.end_fill(1, ticket, info)
+        self.assertEqual(self.cache.get(1), info)
+        # the cache keeps a copy of its own
+        info['credits'] = 0
+        self.assertEqual(self.cache.get(1)['credits'], 100)
+
+    def test_fill_racing_put_fresh(self):
+        # the read started before the write, and finished after it
+        ticket = self.cache.begin_fill(1)
+        self.cache.put_fresh(1, {'nickname': 'bob', 'credits': 90})
+        self.cache.end_fill(1, ticket, {'nickname': 'bob', 'credits': 100})
+        self.assertEqual(self.cache.get(1)['credits'], 90)
+
+    def test_fill_racing_add_credits(self):
+        ticket = self.cache.begin_fill(1)
+        self.cache.add_credits(1, 50)
+        self.cache.end_fill(1, ticket, {'nickname': 'bob', 'credits': 100})
+        # the read may have missed the credits, it isn't cached
+        self.assertIsNone(self.cache.get(1))
+
+    def test_add_credits_to_cached(self):
+        self.cache.put_fresh(1, {'nickname': 'bob', 'credits': 100})
+        self.cache.add_credits(1, 50)
+        self.assertEqual(self.cache.get(1)['credits'], 150)
+
+    def test_later_fill_wins(self):
+        first = self.cache.begin_fill(1)
+        second = self.cache.begin_fill(1)
+        self.cache.end_fill(1, first, {'nickname': 'bob', 'credits': 100})
+        self.assertIsNone(self.cache.get(1))
+        self.cache.end_fill(1, second, {'nickname': 'bob', 'credits': 120})
+        self.assertEqual(self.cache.get(1)['credits'], 120)
+
+    def test_fill_of_missing_account(self):
+        ticket = self.cache.begin_fill(1)
+        self.cache.end_fill(1, ticket, None)
+        self.assertIsNone(self.cache.get(1))
+        self.assertEqual(len(self.cache), 0)
+
+
+class TokenCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = TokenCache(10)
+
+    def test_without_exp(self):
+        self.assertIsNone(self.cache.get_account_id('token'))
+        self.cache.put_token('token', {'account_id': 7})
+        self.assertEqual(self.cache.get_account_id('token'), 7)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_exp(self):
+        self.cache.put_token('token', {'account_id': 7, 'exp': time.time() + 60})
+        self.assertEqual(self.cache.get_account_id('token'), 7)
+
+    def test_expired(self):
+        self.cache.put_token('token', {'account_id': 7, 'exp': time.time() - 1})
+        # jwt.decode gets to reject it, and the entry is gone
+        self.assertIsNone(self.cache.get_account_id('token'))
+        self.assertEqual(len(self.cache), 0)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (0, 1))
+
+    def test_pop(self):
+        # logout drops the token
+        self.cache.put_token('token', {'account_id': 7})
+        self.cache.pop('token')
+        self.assertIsNone(self.cache.get_account_id('token'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import gzip
+import unittest
+
+from aiohttp import hdrs
+from aiohttp.test_utils import make_mocked_request
+
+from catalog import EncodedJson
+
+
+class EncodedJsonTest(unittest.TestCase):
+    def setUp(self):
+        self.document = EncodedJson({'status': 'ok', 'data': {'1': {'price': 10}}})
+
+    def test_pick_encoding(self):
+        pick = self.document.pick_encoding
+        self.assertEqual(pick(''), None)
+        self.assertEqual(pick('gzip, deflate'), 'gzip')
+        self.assertEqual(pick('deflate'), 'deflate')
+        self.assertEqual(pick('br, *'), 'gzip')
+        self.assertEqual(pick('identity'), None)
+
+    def test_pick_encoding_q0(self):
+        pick = self.document.pick_encoding
+        self.assertEqual(pick('gzip;q=0, deflate'), 'deflate')
+        self.assertEqual(pick('gzip; q=0.0'), None)
+        # q=0 wins over the wildcard
+        self.assertEqual(pick('gzip;q=0, *'), 'deflate')
+        self.assertEqual(pick('*, gzip;q=0, deflate;q=0'), None)
+        self.assertEqual(pick('*;q=0'), None)
+
+    def request(self, method='GET', **headers):
+        return make_mocked_request(method, '/get_all_items', headers=headers)
+
+    def test_response(self):
+        response = self.document.response(self.request(**{hdrs.ACCEPT_ENCODING: 'gzip'}))
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.headers[hdrs.CONTENT_ENCODING], 'gzip')
+        self.assertEqual(gzip.decompress(response.body), self.document.bodies[None])
+        self.assertNotEqual(response.headers[hdrs.ETAG], self.document.etags[None])
+
+    def test_not_modified(self):
+        etag = self.document.etags[None]
+        for method in ['GET', 'HEAD']:
+            response = self.document.response(self.request(method, **{hdrs.IF_NONE_MATCH: etag}))
+            self.assertEqual(response.status, 304)
+        response = self.document.response(self.request(**{hdrs.IF_NONE_MATCH: '*'}))
+        self.assertEqual(response.status, 304)
+        # the etag of another encoding doesn't match
+        response = self.document.response(self.request(**{
+            hdrs.IF_NONE_MATCH: etag, hdrs.ACCEPT_ENCODING: 'gzip'}))
+        self.assertEqual(response.status, 200)
+
+    def test_not_modified_only_get_head(self):
+        response = self.document.response(self.request(
+            'POST', **{hdrs.IF_NONE_MATCH: self.document.etags[None]}))
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.body, self.document.bodies[None])
+
+
+if __name__ == '__main__':
+    unittest.main()
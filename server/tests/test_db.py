@@ -0,0 +1,115 @@
+import asyncio
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+from contextlib import closing
+from pathlib import Path
+
+import aiounittest
+
+import db
+from migrations import migrate
+
+
+class ImportTest(unittest.TestCase):
+    def test_no_web_stack(self):
+        # the storage layer is used by the benchmarks without a server
+        script = 'import sys, db; print(sorted(m for m in sys.modules if m.startswith("aiohttp")))'
+        output = subprocess.run(
+            [sys.executable, '-c', script], cwd=Path(db.__file__).parent,
+            check=True, capture_output=True, text=True).stdout
+        self.assertEqual(output.strip(), '[]')
+
+
+class DbTest(aiounittest.AsyncTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp.name) / 'db.sqlite3'
+        with closing(sqlite3.connect(self.path)) as conn:
+            migrate(conn)
+            conn.execute("INSERT INTO Accounts (nickname, credits) VALUES ('bob', 100)")
+            conn.commit()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    async def open_pool(self, group_commit):
+        return await db.open_pool(self.path, 2, group_commit=group_commit)
+
+    async def check_concurrent_trades(self, group_commit):
+        pool = await self.open_pool(group_commit)
+        try:
+            account_id = await db.find_or_create_account(pool, 'bob')
+
+            # the same item is bought once
+            results = await asyncio.gather(*[
+                db.try_buy_item(pool, account_id, 1, 10) for _ in range(10)])
+            self.assertEqual(sum(ok for ok, _, _ in results), 1)
+            self.assertEqual(await db.get_my_items(pool, account_id), [1])
+            self.assertEqual((await db.get_account_info(pool, account_id))['credits'], 90)
+
+            # the credits are enough for one of the items only
+            results = await asyncio.gather(*[
+                db.try_buy_item(pool, account_id, item_id, 60) for item_id in range(2, 12)])
+            self.assertEqual(sum(ok for ok, _, _ in results), 1)
+            self.assertEqual((await db.get_account_info(pool, account_id))['credits'], 30)
+            self.assertEqual(len(await db.get_my_items(pool, account_id)), 2)
+
+            # and sold once
+            results = await asyncio.gather(*[
+                db.try_sell_item(pool, account_id, 1, 10) for _ in range(10)])
+            self.assertEqual(sum(ok for ok, _, _ in results), 1)
+            self.assertEqual((await db.get_account_info(pool, account_id))['credits'], 40)
+            self.assertEqual(len(await db.get_my_items(pool, account_id)), 1)
+        finally:
+            await pool.close()
+
+    async def test_concurrent_trades(self):
+        await self.check_concurrent_trades(group_commit=False)
+
+    async def test_concurrent_trades_group_commit(self):
+        await self.check_concurrent_trades(group_commit=True)
+
+    async def test_trade_state(self):
+        pool = await self.open_pool(group_commit=False)
+        try:
+            account_id = await db.find_or_create_account(pool, 'bob')
+            ok, _, state = await db.try_buy_item(pool, account_id, 1, 30, with_items=True)
+            self.assertTrue(ok)
+            self.assertEqual(state, {'account': {'nickname': 'bob', 'credits': 70}, 'items': [1]})
+            ok, _, state = await db.try_sell_item(pool, account_id, 2, 30)
+            self.assertFalse(ok)
+            self.assertIsNone(state)
+        finally:
+            await pool.close()
+
+    async def test_group_commit_isolation(self):
+        def insert(conn, nickname):
+            conn.execute('INSERT INTO Accounts (nickname) VALUES (?)', [nickname])
+
+        def insert_and_fail(conn, nickname):
+            insert(conn, nickname)
+            raise ValueError(nickname)
+
+        pool = await self.open_pool(group_commit=True)
+        # a long window, the batch is flushed by its size
+        pool.group_committer.window = 10
+        pool.group_committer.max_batch = 3
+        try:
+            results = await asyncio.gather(
+                pool.write(insert, 'first'),
+                pool.write(insert_and_fail, 'failed'),
+                pool.write(insert, 'last'),
+                return_exceptions=True)
+            self.assertIsNone(results[0])
+            self.assertIsInstance(results[1], ValueError)
+            self.assertIsNone(results[2])
+
+            def nicknames(conn):
+                return [row['nickname'] for row in conn.execute(
+                    'SELECT nickname FROM Accounts ORDER BY rowid')]
+            self.assertEqual(await pool.read(nicknames), ['bob', 'first', 'last'])
+        finally:
+            await pool.close()
@@ -0,0 +1,208 @@
+import sqlite3
+import tempfile
+import unittest
+from contextlib import closing
+from pathlib import Path
+
+import aiounittest
+from aiohttp import hdrs
+from aiohttp.test_utils import TestClient, TestServer
+
+import db
+import main
+from config import ServerConfig
+from session import SharedSessionStore
+
+
+class ServerTest(aiounittest.AsyncTestCase):
+    ''' Runs main's app in this process, on a database of its own;
+    run from the server directory, like the server '''
+
+    config = {}
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.sqlite_db = db.sqlite_db
+        db.sqlite_db = Path(self.tmp.name) / 'db.sqlite3'
+        config = ServerConfig()
+        config.workers = 1
+        for name, value in self.config.items():
+            setattr(config, name, value)
+        main.init_globals(config)
+        db.migrate_db()
+
+    def tearDown(self):
+        db.sqlite_db = self.sqlite_db
+        self.tmp.cleanup()
+
+    async def client(self):
+        client = TestClient(TestServer(await main.init_app()))
+        await client.start_server()
+        return client
+
+    async def login(self, client, nickname='bob'):
+        response = await client.post('/login', json={'nickname': nickname})
+        data = await response.json()
+        self.assertEqual(data['status'], 'ok', data)
+        return data['token']
+
+    async def batch(self, client, token, ops, **kwargs):
+        response = await client.post(
+            '/batch', json={'ops': ops, **kwargs},
+            headers={hdrs.AUTHORIZATION: f'Bearer {token}'})
+        return response.status, await response.json()
+
+
+class AuthTest(ServerTest):
+    async def test_token(self):
+        client = await self.client()
+        try:
+            token = await self.login(client)
+            response = await client.get(
+                '/get_account_info', headers={hdrs.AUTHORIZATION: f'Bearer {token}'})
+            self.assertEqual(response.status, 200)
+            self.assertEqual((await response.json())['data']['nickname'], 'bob')
+
+            # clients which send the token in the body
+            response = await client.post('/get_account_info', json={'token': token})
+            self.assertEqual(response.status, 200)
+            self.assertEqual((await response.json())['status'], 'ok')
+        finally:
+            await client.close()
+
+    async def test_invalid_token(self):
+        client = await self.client()
+        try:
+            for headers in [{}, {hdrs.AUTHORIZATION: 'Bearer nonsense'}, {hdrs.AUTHORIZATION: 'Basic x'}]:
+                response = await client.get('/get_my_items', headers=headers)
+                self.assertEqual(response.status, 401)
+                self.assertEqual(await response.json(), {'status': 'error', 'data': 'Invalid token!'})
+            response = await client.post('/get_my_items', data='not json')
+            self.assertEqual(response.status, 401)
+        finally:
+            await client.close()
+
+    async def test_session_ended(self):
+        client = await self.client()
+        try:
+            token = await self.login(client)
+            headers = {hdrs.AUTHORIZATION: f'Bearer {token}'}
+            response = await client.post('/logout', headers=headers)
+            self.assertEqual((await response.json())['status'], 'ok')
+            # the token is still valid, the session is gone
+            response = await client.get('/get_my_items', headers=headers)
+            self.assertEqual(response.status, 401)
+            self.assertEqual((await response.json())['data'], 'Session not found!')
+        finally:
+            await client.close()
+
+    async def test_public_and_unknown_paths(self):
+        client = await self.client()
+        try:
+            response = await client.get('/metrics')
+            self.assertEqual(response.status, 200)
+            # no route, no authentication either
+            response = await client.get('/nope')
+            self.assertEqual(response.status, 404)
+        finally:
+            await client.close()
+
+    async def test_sessions_busy(self):
+        path = Path(self.tmp.name) / 'sessions.sqlite3'
+        SharedSessionStore.reset(path)
+        # every touch writes, and another process holds the write lock
+        main.g_sessions = SharedSessionStore(
+            path, 60, 600, touch_interval=0, busy_timeout=0.01)
+        client = await self.client()
+        try:
+            token = await self.login(client)
+            with closing(sqlite3.connect(str(path), isolation_level=None)) as other:
+                other.execute('BEGIN IMMEDIATE')
+                response = await client.get(
+                    '/get_my_items', headers={hdrs.AUTHORIZATION: f'Bearer {token}'})
+                other.execute('ROLLBACK')
+            self.assertEqual(response.status, 503)
+            self.assertEqual(response.headers[hdrs.RETRY_AFTER], str(main.g_config.retry_after))
+        finally:
+            await client.close()
+            main.g_sessions.conn.close()
+
+
+class BatchTest(ServerTest):
+    config = {'batch_max_ops': 4}
+
+    async def test_batch(self):
+        client = await self.client()
+        try:
+            token = await self.login(client)
+            status, res = await self.batch(client, token, [
+                {'op': 'get_account_info'},
+                {'op': 'buy_item', 'args': {'id': 2}},
+                {'op': 'nope'},
+                {'op': 'get_my_items'}])
+            self.assertEqual(status, 200)
+            self.assertEqual(res['status'], 'ok')
+            results = res['data']
+            self.assertEqual(results[0]['data']['nickname'], 'bob')
+            self.assertEqual(results[1]['status'], 'error')
+            self.assertEqual(results[2], {'status': 'error', 'data': 'Unknown operation!'})
+            self.assertEqual(results[3], {'status': 'ok', 'data': []})
+        finally:
+            await client.close()
+
+    async def test_stop_on_error(self):
+        client = await self.client()
+        try:
+            token = await self.login(client)
+            ops = [{'op': 'get_my_items'}, {'op': 'sell_item', 'args': {'id': 1}}, {'op': 'get_my_items'}]
+            _, res = await self.batch(client, token, ops, stop_on_error=True)
+            self.assertEqual([result['status'] for result in res['data']], ['ok', 'error'])
+            _, res = await self.batch(client, token, ops)
+            self.assertEqual([result['status'] for result in res['data']], ['ok', 'error', 'ok'])
+        finally:
+            await client.close()
+
+    async def test_invalid_batch(self):
+        client = await self.client()
+        try:
+            token = await self.login(client)
+            for ops in [None, {'op': 'get_my_items'}, ['get_my_items']]:
+                _, res = await self.batch(client, token, ops)
+                self.assertEqual(res, {'status': 'error', 'data': 'Invalid batch!'})
+            _, res = await self.batch(client, token, [{'op': 'get_my_items'}] * 5)
+            self.assertEqual(res, {'status': 'error', 'data': 'Too many operations in the batch!'})
+        finally:
+            await client.close()
+
+
+class RateLimitedBatchTest(ServerTest):
+    config = {'batch_max_ops': 20, 'rate_limit_per_second': 1.0, 'rate_limit_burst': 3}
+
+    async def test_over_burst(self):
+        client = await self.client()
+        try:
+            token = await self.login(client)
+            # more operations than the burst could ever allow
+            _, res = await self.batch(client, token, [{'op': 'get_my_items'}] * 4)
+            self.assertEqual(res, {'status': 'error', 'data': 'Too many operations in the batch!'})
+        finally:
+            await client.close()
+
+    async def test_operations_take_tokens(self):
+        client = await self.client()
+        try:
+            token = await self.login(client)
+            ops = [{'op': 'get_my_items'}] * 2
+            status, res = await self.batch(client, token, ops)
+            self.assertEqual(status, 200)
+            self.assertEqual(len(res['data']), 2)
+            # one token is left, the batch takes it and needs another
+            status, res = await self.batch(client, token, ops)
+            self.assertEqual(status, 429)
+            self.assertEqual(res['data'], 'Too many requests!')
+        finally:
+            await client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import sqlite3
+import unittest
+from contextlib import closing
+
+from migrations import MIGRATIONS, get_schema_version, migrate
+
+
+class MigrationsTest(unittest.TestCase):
+    def connect(self):
+        conn = sqlite3.connect(':memory:')
+        conn.row_factory = sqlite3.Row
+        return closing(conn)
+
+    def test_fresh_database(self):
+        with self.connect() as conn:
+            self.assertEqual(migrate(conn), len(MIGRATIONS))
+            self.assertEqual(get_schema_version(conn), len(MIGRATIONS))
+            # applied migrations aren't run again
+            self.assertEqual(migrate(conn), len(MIGRATIONS))
+
+    def test_merge_duplicate_nicknames(self):
+        with self.connect() as conn:
+            migrate(conn, 1)
+            conn.executemany(
+                'INSERT INTO Accounts (nickname, credits) VALUES (?, ?)',
+                [('bob', 100), ('alice', 5), ('Bob', 20), ('BOB', 3)])
+            conn.executemany(
+                'INSERT INTO Items (account_id, item_id) VALUES (?, ?)',
+                [(1, 1), (3, 1), (3, 2), (4, 3), (2, 1), (99, 1)])
+            conn.commit()
+
+            migrate(conn)
+
+            accounts = conn.execute('SELECT rowid, nickname, credits FROM Accounts ORDER BY rowid').fetchall()
+            self.assertEqual([tuple(row) for row in accounts], [(1, 'bob', 123), (2, 'alice', 5)])
+            items = conn.execute('SELECT account_id, item_id FROM Items ORDER BY account_id, item_id').fetchall()
+            # the item owned by two of the duplicates is kept once,
+            # items of unknown accounts are left alone
+            self.assertEqual([tuple(row) for row in items], [(1, 1), (1, 2), (1, 3), (2, 1), (99, 1)])
+
+            with self.assertRaises(sqlite3.IntegrityError):
+                conn.execute('INSERT INTO Accounts (nickname) VALUES (?)', ['bOb'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from session import SessionStore, SharedSessionStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ExpiryTests:
+    ''' The same for the local and the shared store '''
+
+    def setUp(self):
+        self.clock = Clock()
+        # idle for 10 seconds, or 25 seconds after login
+        self.store = self.make_store(10, 25)
+
+    def test_idle_expiry(self):
+        self.assertTrue(self.store.try_create(1))
+        self.assertFalse(self.store.try_create(1))
+        self.clock.now += 9
+        self.assertIn(1, self.store)
+        self.clock.now += 1
+        self.assertNotIn(1, self.store)
+        self.assertFalse(self.store.touch(1))
+        # an expired session is replaced at login
+        self.assertTrue(self.store.try_create(1))
+
+    def test_touch_extends_up_to_absolute_expiry(self):
+        self.store.try_create(1)
+        for _ in range(4):
+            self.clock.now += 6
+            self.assertTrue(self.store.touch(1))
+        # 24 seconds after login, touched a moment ago
+        self.assertIn(1, self.store)
+        self.clock.now += 1
+        self.assertNotIn(1, self.store)
+        self.assertFalse(self.store.touch(1))
+
+    def test_sweep(self):
+        self.store.try_create(1)
+        self.store.try_create(2)
+        self.clock.now += 6
+        self.store.touch(2)
+        self.clock.now += 4
+        self.assertEqual(self.store.sweep(), 1)
+        self.assertNotIn(1, self.store)
+        self.assertIn(2, self.store)
+        self.assertEqual(len(self.store), 1)
+        self.clock.now += 6
+        self.assertEqual(self.store.sweep(), 1)
+        self.assertEqual(len(self.store), 0)
+        self.assertEqual(self.store.expired, 2)
+
+
+class SessionStoreTest(ExpiryTests, unittest.TestCase):
+    def make_store(self, idle_ttl, absolute_ttl):
+        return SessionStore(idle_ttl, absolute_ttl, clock=self.clock)
+
+    def test_stale_entries_after_remove(self):
+        self.store.try_create(1)
+        self.assertTrue(self.store.remove(1))
+        self.assertFalse(self.store.remove(1))
+        # a new login of the account pushes a second entry
+        self.clock.now += 5
+        self.store.try_create(1)
+        self.assertEqual(len(self.store._heap), 2)
+        # the entry of the removed session doesn't expire the new one
+        self.clock.now += 5
+        self.assertEqual(self.store.sweep(), 0)
+        self.assertIn(1, self.store)
+        self.assertEqual(len(self.store._heap), 1)
+        self.clock.now += 5
+        self.assertEqual(self.store.sweep(), 1)
+        self.assertEqual(self.store._heap, [])
+
+    def test_sweep_limit(self):
+        for account_id in range(5):
+            self.store.try_create(account_id)
+        self.clock.now += 10
+        self.assertTrue(self.store.is_sweep_due())
+        self.assertEqual(self.store.sweep(limit=2), 2)
+        self.assertTrue(self.store.is_sweep_due())
+        self.assertEqual(self.store.sweep(), 3)
+        self.assertFalse(self.store.is_sweep_due())
+
+    def test_refreshed_entry_is_put_back(self):
+        self.store.try_create(1)
+        self.clock.now += 9
+        self.store.touch(1)
+        self.clock.now += 1
+        # the entry is due, the session isn't
+        self.assertEqual(self.store.sweep(), 0)
+        self.assertEqual(len(self.store._heap), 1)
+        self.assertGreater(self.store._heap[0][0], self.clock.now)
+
+
+class SharedSessionStoreTest(ExpiryTests, unittest.TestCase):
+    ''' Sessions in the table the worker processes share '''
+
+    def make_store(self, idle_ttl, absolute_ttl):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        path = Path(self.tmp.name) / 'sessions.sqlite3'
+        SharedSessionStore.reset(path)
+        store = SharedSessionStore(path, idle_ttl, absolute_ttl, touch_interval=0, clock=self.clock)
+        self.addCleanup(store.conn.close)
+        return store
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import json
+import os
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import urllib.request
+from pathlib import Path
+
+
+server_dir = Path(__file__).resolve().parent.parent
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), 'workers are forked')
+class WorkersTest(unittest.TestCase):
+    ''' Runs main.py with several workers in a directory of its own '''
+
+    workers = 3
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        shutil.copytree(server_dir / 'data', self.dir / 'data')
+        self.log = (self.dir / 'server.log').open('w+')
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            try:
+                os.killpg(self.server.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            self.server.wait()
+        self.log.close()
+        self.tmp.cleanup()
+
+    def start(self, **config):
+        cfg_path = self.dir / 'data' / 'server_config.json'
+        cfg = json.loads(cfg_path.read_text())
+        self.port = free_port()
+        cfg.update(workers=self.workers, port=self.port, host='localhost', **config)
+        cfg_path.write_text(json.dumps(cfg))
+        # a session of its own, so the whole process group can be signalled
+        self.server = subprocess.Popen(
+            [sys.executable, str(server_dir / 'main.py')], cwd=self.dir,
+            stdout=self.log, stderr=subprocess.STDOUT, start_new_session=True)
+
+    def server_log(self):
+        self.log.seek(0)
+        return self.log.read()
+
+    def wait_until_serving(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                with socket.create_connection(('localhost', self.port), timeout=1):
+                    return
+            except OSError:
+                if time.monotonic() > deadline or self.server.poll() is not None:
+                    self.fail('server did not start:\n' + self.server_log())
+                time.sleep(0.1)
+
+    def login(self, nickname):
+        request = urllib.request.Request(
+            f'http://localhost:{self.port}/login', method='POST',
+            data=json.dumps({'nickname': nickname}).encode())
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return json.load(response)
+
+    def worker_pid(self):
+        with urllib.request.urlopen(f'http://localhost:{self.port}/metrics', timeout=10) as response:
+            metrics = response.read().decode()
+        return int(re.search(r'^server_worker\{pid="(\d+)"\}', metrics, re.M).group(1))
+
+    def serve(self):
+        self.start()
+        self.wait_until_serving()
+        # new connections each, the kernel spreads them between the workers
+        for i in range(30):
+            self.assertEqual(self.login(f'player{i}')['status'], 'ok')
+
+    def assert_all_exit(self, timeout=15):
+        try:
+            self.server.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.fail('server did not exit:\n' + self.server_log())
+        # no worker is left in the process group
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                os.killpg(self.server.pid, 0)
+            except ProcessLookupError:
+                return
+            if time.monotonic() > deadline:
+                self.fail('workers did not exit:\n' + self.server_log())
+            time.sleep(0.1)
+
+    def test_interrupt(self):
+        self.serve()
+        # ctrl-c signals every process of the group
+        os.killpg(self.server.pid, signal.SIGINT)
+        self.assert_all_exit()
+        self.assertNotIn('did not exit', self.server_log())
+
+    def test_terminate(self):
+        self.serve()
+        # the parent passes the signal on to the workers
+        self.server.terminate()
+        self.assert_all_exit()
+        self.assertNotIn('did not exit', self.server_log())
+
+    def test_hung_worker(self):
+        self.start(worker_shutdown_timeout=1.0)
+        self.wait_until_serving()
+        os.kill(self.worker_pid(), signal.SIGSTOP)
+        self.server.terminate()
+        self.assert_all_exit()
+        self.assertIn('did not exit, terminating it', self.server_log())
+
+    def test_second_interrupt(self):
+        self.start(worker_shutdown_timeout=60.0)
+        self.wait_until_serving()
+        os.kill(self.worker_pid(), signal.SIGSTOP)
+        os.killpg(self.server.pid, signal.SIGINT)
+        time.sleep(0.5)
+        # doesn't wait for the shutdown timeout
+        self.server.send_signal(signal.SIGINT)
+        self.assert_all_exit()
+        log = self.server_log()
+        self.assertIn('did not exit, terminating it', log)
+        self.assertNotIn('Traceback', log)
+
+
+if __name__ == '__main__':
+    unittest.main()
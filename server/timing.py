@@ -0,0 +1,55 @@
+import logging
+import random
+import time
+from aiohttp import web
+
+from phases import RequestTiming, current, phase
+
+
+LOG = logging.getLogger('server.timing')
+
+
+def json_response(data, **kwargs):
+    with phase('serialize'):
+        return web.json_response(data, **kwargs)
+
+
+class Timing:
+    ''' Opt-in timing of request phases, reported in the Server-Timing
+    header and in a sampled log line for slow requests '''
+
+    def __init__(self, slow_threshold=0.5, slow_sample_rate=1.0):
+        self.slow_threshold = slow_threshold
+        self.slow_sample_rate = slow_sample_rate
+        self.slow_requests = 0
+
+    def log_slow(self, request, status, total, header):
+        self.slow_requests += 1
+        if random.random() < self.slow_sample_rate:
+            LOG.warning('slow request %s %s %s %.1fms: %s',
+                        request.method, request.path, status, total * 1e3, header)
+
+    @property
+    def middleware(self):
+        @web.middleware
+        async def timing_middleware(request, handler):
+            timing = RequestTiming()
+            reset = current.set(timing)
+            before = time.perf_counter()
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status
+                header = timing.header(time.perf_counter() - before)
+                response.headers['Server-Timing'] = header
+                return response
+            except web.HTTPException as e:
+                status = e.status
+                raise
+            finally:
+                current.reset(reset)
+                total = time.perf_counter() - before
+                if total >= self.slow_threshold:
+                    self.log_slow(request, status, total, timing.header(total))
+
+        return timing_middleware